@@ -1,34 +1,142 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory, abort, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
-from sqlalchemy import func, extract, or_, and_
+from datetime import datetime, timedelta, date
+from sqlalchemy import func, extract, or_, and_, case, text, inspect, update, insert, select, event, type_coerce, literal, literal_column, tuple_, union_all, create_engine
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.expression import UpdateBase
 from calendar import monthrange
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from types import SimpleNamespace
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
 import os
+import re
+import json
+import time
+import click
+import multiprocessing
+import threading
+import io
+import csv
 import base64
+import shutil
+import gzip
+import hashlib
+import mimetypes
+import unicodedata
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: o limite de hashes simultâneos passa a valer por processo
+    fcntl = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sua-chave-secreta-aqui-mude-em-producao'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///finance.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///finance.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max
+app.config['INVOICE_CYCLES_MONTHS_BACK'] = 12  # Ciclos de fatura gerados para trás
+app.config['INVOICE_CYCLES_MONTHS_AHEAD'] = 24  # Ciclos gerados à frente (parcelamento até 24x)
+app.config['DUPLICATE_WINDOW_DAYS'] = 3  # Tolerância de datas na detecção de duplicatas
+app.config['JOB_WORKERS'] = 2  # Processos iniciados por `flask worker`
+app.config['JOB_MAX_PER_USER'] = 1  # Tarefas simultâneas por usuário
+app.config['JOB_MAX_ATTEMPTS'] = 3  # Tentativas antes de marcar a tarefa como falha
+app.config['JOB_RETRY_DELAY'] = 30  # Segundos até a 1ª nova tentativa (dobra a cada falha)
+app.config['JOB_POLL_INTERVAL'] = 2  # Segundos entre consultas à fila quando ociosa
+app.config['JOB_TIMEOUT'] = 3600  # Tarefas em execução há mais tempo voltam para a fila
+app.config['JOB_CHUNK_SIZE'] = 500  # Linhas por etapa nas importações em segundo plano
+app.config['JOBS_INLINE'] = False  # Executa as tarefas na própria requisição (sem worker)
+app.config['ARCHIVE_AFTER_MONTHS'] = 24  # Lançamentos mais antigos que isso vão para o arquivo
+app.config['STATEMENT_PAGE_SIZE'] = 200  # Linhas por página no extrato da conta
+app.config['COMPRESS_LEVEL'] = 6  # Nível do gzip nas respostas HTML/JSON
+app.config['COMPRESS_MIN_SIZE'] = 500  # Respostas menores que isso (bytes) não são comprimidas
+app.config['RECEIPT_DECODE_PROCESSES'] = 2  # Processos que decodificam comprovantes (por worker de tarefas)
+app.config['RECEIPT_MAX_SIDE'] = 1600  # Lado máximo (px) da 1ª leitura; a resolução original é a última tentativa
+app.config['RECEIPT_DECODE_TIMEOUT'] = 30  # Segundos por imagem antes de desistir
+app.config['PARTITION_MODE'] = os.environ.get('PARTITION_MODE', 'off')  # off, user (um banco por usuário) ou bucket
+app.config['PARTITION_DIR'] = os.environ.get('PARTITION_DIR', os.path.join(app.instance_path, 'partitions'))
+app.config['PARTITION_BUCKETS'] = int(os.environ.get('PARTITION_BUCKETS', 16))  # Bancos no modo bucket
+app.config['PARTITION_ENGINE_CACHE'] = 32  # Partições com conexões abertas por processo (as menos usadas são fechadas)
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')  # Algoritmo e custo (formato do Werkzeug)
+app.config['PASSWORD_SALT_LENGTH'] = 16
+app.config['PASSWORD_HASH_CONCURRENCY'] = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 2))  # Hashes de senha simultâneos, somando todos os processos
+app.config['PASSWORD_HASH_WAIT'] = 0.5  # Segundos esperando uma vaga antes de recusar o login (curto: quem espera segura o worker)
+app.config['PASSWORD_SLOT_DIR'] = os.path.join(app.instance_path, 'password-slots')  # Travas das vagas (compartilhadas entre processos)
 
 # Criar pasta de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-db = SQLAlchemy(app)
+
+
+class PartitionedSession(FlaskSession):
+    """Sessão que envia as tabelas financeiras ao banco da partição do usuário (ver PARTICIONAMENTO)"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and app.config['PARTITION_MODE'] != 'off' and not is_catalog_statement(mapper, clause):
+            key = current_partition()
+            if key:
+                return partition_engine(key)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': PartitionedSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Tipos
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    """Converte um valor em reais (Decimal, str, int ou float) para centavos inteiros"""
+    return int((Decimal(str(value)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def parse_money(value, default=None):
+    """Converte o valor de um formulário para Decimal com duas casas"""
+    if value is None or str(value).strip() == '':
+        return default
+    try:
+        return Decimal(str(value).strip()).quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f'Valor inválido: {value}')
+
+
+def split_amount(total, parts):
+    """Divide um valor em parcelas exatas: o resto em centavos vai para as primeiras"""
+    base, remainder = divmod(to_cents(total), parts)
+    return [Decimal(base + (1 if i < remainder else 0)).scaleb(-2) for i in range(parts)]
+
+
+class Money(db.TypeDecorator):
+    """Valor monetário: centavos inteiros no banco, Decimal com duas casas no Python"""
+    impl = db.Integer
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_cents(value)
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else Decimal(int(value)).scaleb(-2)
+
+
 # Models
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
+    archived_until = db.Column(db.Date)  # Lançamentos anteriores a esta data podem estar no arquivo
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     accounts = db.relationship('Account', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -39,10 +147,17 @@ class User(UserMixin, db.Model):
     transfers = db.relationship('Transfer', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = run_password_hash(
+            generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_SALT_LENGTH']
+        )
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return run_password_hash(check_password_hash, self.password_hash, password)
+    
+    @property
+    def password_needs_rehash(self):
+        """O hash guardado foi gerado com outro algoritmo ou custo que o de PASSWORD_HASH_METHOD"""
+        return self.password_hash.split('$', 1)[0] != password_hash_method()
 
 
 class Account(db.Model):
@@ -50,8 +165,8 @@ class Account(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     type = db.Column(db.String(50), nullable=False)
-    initial_balance = db.Column(db.Float, default=0.0)
-    current_balance = db.Column(db.Float, default=0.0)
+    initial_balance = db.Column(Money, default=0)
+    current_balance = db.Column(Money, default=0)
     color = db.Column(db.String(7), default='#3B82F6')
     icon = db.Column(db.String(50), default='bank')
     active = db.Column(db.Boolean, default=True)
@@ -78,7 +193,7 @@ class CreditCard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    limit = db.Column(db.Float, nullable=False)
+    limit = db.Column(Money, nullable=False)
     closing_day = db.Column(db.Integer, nullable=False)  # Dia do fechamento (1-31)
     due_day = db.Column(db.Integer, nullable=False)  # Dia do vencimento (1-31)
     color = db.Column(db.String(7), default='#8B5CF6')
@@ -88,52 +203,188 @@ class CreditCard(db.Model):
     
     transactions = db.relationship('Transaction', backref='credit_card', lazy=True)
     
-    def get_current_invoice_period(self):
-        """Retorna período da fatura atual (início e fim)"""
-        today = datetime.today()
+    def generate_invoice_cycles(self, start_year, start_month, count):
+        """Gera (ou recalcula) os ciclos de fatura a partir de um mês de referência"""
+        first = start_year * 12 + start_month - 1
+        existing = {
+            (cycle.year, cycle.month): cycle
+            for cycle in InvoiceCycle.query.filter(
+                InvoiceCycle.credit_card_id == self.id,
+                InvoiceCycle.year * 12 + InvoiceCycle.month - 1 >= first,
+                InvoiceCycle.year * 12 + InvoiceCycle.month - 1 < first + count
+            )
+        }
         
-        if today.day < self.closing_day:
-            # Fatura atual: mês passado até este mês
-            end_date = datetime(today.year, today.month, self.closing_day)
-            if today.month == 1:
-                start_date = datetime(today.year - 1, 12, self.closing_day)
-            else:
-                start_date = datetime(today.year, today.month - 1, self.closing_day)
-        else:
-            # Fatura atual: este mês até próximo mês
-            start_date = datetime(today.year, today.month, self.closing_day)
-            if today.month == 12:
-                end_date = datetime(today.year + 1, 1, self.closing_day)
-            else:
-                end_date = datetime(today.year, today.month + 1, self.closing_day)
+        for i in range(count):
+            year, month = add_months(start_year, start_month, i)
+            period = compute_invoice_cycle(self.closing_day, self.due_day, year, month)
+            cycle = existing.get((year, month))
+            if cycle is None:
+                cycle = InvoiceCycle(credit_card_id=self.id, year=year, month=month)
+                db.session.add(cycle)
+            for field, value in period.items():
+                setattr(cycle, field, value)
+    
+    def regenerate_invoice_cycles(self):
+        """Recalcula todos os ciclos já gerados após mudança dos dias de fechamento/vencimento"""
+        bounds = db.session.query(
+            func.min(InvoiceCycle.year * 12 + InvoiceCycle.month - 1),
+            func.max(InvoiceCycle.year * 12 + InvoiceCycle.month - 1)
+        ).filter(InvoiceCycle.credit_card_id == self.id).one()
+        
+        if bounds[0] is None:
+            return
+        
+        self.generate_invoice_cycles(bounds[0] // 12, bounds[0] % 12 + 1, bounds[1] - bounds[0] + 1)
+        db.session.flush()
         
-        return start_date.date(), end_date.date()
+        InvoiceCycle.query.filter_by(credit_card_id=self.id).update(
+            {'total': None, 'total_computed_at': None}, synchronize_session='fetch'
+        )
+        
+        # Parcelas acompanham o vencimento do ciclo ao qual pertencem; os contadores dos orçamentos
+        # (por mês de vencimento) são estornados antes e refeitos depois
+        spending = spending_select(Installment.__table__, Installment.credit_card_id == self.id)
+        upsert_spending(db.session.execute(spending).all(), sign=-1)
+        db.session.execute(text("""
+            UPDATE installment SET due_date = (
+                SELECT due_date FROM invoice_cycle WHERE invoice_cycle.id = installment.invoice_cycle_id
+            )
+            WHERE credit_card_id = :card_id AND invoice_cycle_id IS NOT NULL
+        """), {'card_id': self.id})
+        upsert_spending(db.session.execute(spending).all())
     
-    def get_invoice_total(self, start_date, end_date):
-        """Calcula o total da fatura em um período"""
-        total = db.session.query(func.sum(Transaction.amount)).filter(
-            Transaction.credit_card_id == self.id,
-            Transaction.type == 'expense',
-            Transaction.date >= start_date,
-            Transaction.date < end_date
-        ).scalar() or 0
+    def get_invoice_cycle(self, on_date=None):
+        """Retorna o ciclo de fatura que contém a data (padrão: hoje)"""
+        on_date = on_date or date.today()
+        cycle = InvoiceCycle.query.filter(
+            InvoiceCycle.credit_card_id == self.id,
+            InvoiceCycle.start_date <= on_date,
+            InvoiceCycle.end_date > on_date
+        ).first()
         
-        # Adicionar parcelas do período
-        installment_total = db.session.query(func.sum(Installment.amount)).filter(
-            Installment.credit_card_id == self.id,
-            Installment.due_date >= start_date,
-            Installment.due_date < end_date
-        ).scalar() or 0
+        if cycle is None:
+            # Ciclo ainda não gerado: gerar a janela em torno da data
+            year, month = add_months(on_date.year, on_date.month, -app.config['INVOICE_CYCLES_MONTHS_BACK'])
+            self.generate_invoice_cycles(
+                year, month,
+                app.config['INVOICE_CYCLES_MONTHS_BACK'] + app.config['INVOICE_CYCLES_MONTHS_AHEAD'] + 1
+            )
+            db.session.flush()  # Quem chamou confirma junto com o restante da sua operação
+            cycle = InvoiceCycle.query.filter(
+                InvoiceCycle.credit_card_id == self.id,
+                InvoiceCycle.start_date <= on_date,
+                InvoiceCycle.end_date > on_date
+            ).first()
         
-        return total + installment_total
+        return cycle
+    
+    def get_following_cycles(self, first_cycle, count):
+        """Retorna `count` ciclos consecutivos a partir de `first_cycle`"""
+        cycles = InvoiceCycle.query.filter(
+            InvoiceCycle.credit_card_id == self.id,
+            InvoiceCycle.start_date >= first_cycle.start_date
+        ).order_by(InvoiceCycle.start_date).limit(count).all()
+        
+        if len(cycles) < count:
+            self.generate_invoice_cycles(first_cycle.year, first_cycle.month, count)
+            db.session.flush()
+            cycles = InvoiceCycle.query.filter(
+                InvoiceCycle.credit_card_id == self.id,
+                InvoiceCycle.start_date >= first_cycle.start_date
+            ).order_by(InvoiceCycle.start_date).limit(count).all()
+        
+        return cycles
+    
+    def get_current_invoice_period(self):
+        """Retorna período da fatura atual (início e fim)"""
+        cycle = self.get_invoice_cycle()
+        return cycle.start_date, cycle.end_date
+    
+    def get_cycle_totals(self, cycles):
+        """Totais de vários ciclos: fechados vêm do cache, os demais em duas consultas agrupadas"""
+        totals = {cycle.id: cycle.total for cycle in cycles if cycle.is_closed and cycle.total is not None}
+        pending = [cycle.id for cycle in cycles if cycle.id not in totals]
+        
+        if pending:
+            # Ciclos anteriores ao arquivamento também somam as tabelas de arquivo
+            sources = [(Transaction.__table__, Installment.__table__)]
+            archived_until = db.session.get(User, self.user_id).archived_until
+            if archived_until and any(cycle.start_date < archived_until for cycle in cycles if cycle.id in pending):
+                sources.append((transaction_archive, installment_archive))
+            
+            sums = {}
+            for transactions, installments in sources:
+                rows = db.session.query(
+                    InvoiceCycle.id, func.sum(transactions.c.amount)
+                ).join(transactions, and_(
+                    transactions.c.credit_card_id == InvoiceCycle.credit_card_id,
+                    transactions.c.type == 'expense',
+                    transactions.c.date >= InvoiceCycle.start_date,
+                    transactions.c.date < InvoiceCycle.end_date
+                )).filter(InvoiceCycle.id.in_(pending)).group_by(InvoiceCycle.id).all()
+                
+                rows += db.session.query(
+                    installments.c.invoice_cycle_id, func.sum(installments.c.amount)
+                ).filter(installments.c.invoice_cycle_id.in_(pending)).group_by(installments.c.invoice_cycle_id).all()
+                
+                for cycle_id, total in rows:
+                    sums[cycle_id] = sums.get(cycle_id, 0) + (total or 0)
+            
+            for cycle in cycles:
+                if cycle.id in pending:
+                    totals[cycle.id] = sums.get(cycle.id, 0)
+                    cycle.store_total(totals[cycle.id])
+        
+        return totals
+    
+    def get_invoice_total(self, cycle):
+        """Calcula o total da fatura de um ciclo"""
+        return self.get_cycle_totals([cycle])[cycle.id]
     
     def get_available_limit(self):
         """Calcula o limite disponível"""
-        start_date, end_date = self.get_current_invoice_period()
-        used = self.get_invoice_total(start_date, end_date)
+        used = self.get_invoice_total(self.get_invoice_cycle())
         return self.limit - used
 
 
+class InvoiceCycle(db.Model):
+    """Ciclos de fatura pré-calculados de cada cartão"""
+    id = db.Column(db.Integer, primary_key=True)
+    credit_card_id = db.Column(db.Integer, db.ForeignKey('credit_card.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)  # Mês de referência (mês do fechamento)
+    month = db.Column(db.Integer, nullable=False)
+    start_date = db.Column(db.Date, nullable=False)  # Início do ciclo (inclusivo)
+    end_date = db.Column(db.Date, nullable=False)  # Fim do ciclo (exclusivo)
+    closing_date = db.Column(db.Date, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    
+    total = db.Column(Money)  # Total congelado (apenas ciclos fechados)
+    total_computed_at = db.Column(db.DateTime)
+    
+    credit_card = db.relationship('CreditCard', backref=db.backref('invoice_cycles', cascade='all, delete-orphan'))
+    
+    __table_args__ = (
+        db.UniqueConstraint('credit_card_id', 'year', 'month', name='uq_invoice_cycle_card_month'),
+        db.Index('ix_invoice_cycle_card_period', 'credit_card_id', 'start_date', 'end_date'),
+    )
+    
+    @property
+    def reference(self):
+        """Mês de referência no formato YYYY-MM"""
+        return f'{self.year:04d}-{self.month:02d}'
+    
+    @property
+    def is_closed(self):
+        return self.closing_date <= date.today()
+    
+    def store_total(self, total):
+        """Congela o total de um ciclo fechado; o ciclo aberto continua calculado ao vivo"""
+        if self.is_closed:
+            self.total = total
+            self.total_computed_at = datetime.utcnow()
+
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -141,13 +392,23 @@ class Transaction(db.Model):
     credit_card_id = db.Column(db.Integer, db.ForeignKey('credit_card.id'), nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     description = db.Column(db.String(200), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     type = db.Column(db.String(20), nullable=False)
     date = db.Column(db.Date, nullable=False)
     notes = db.Column(db.Text)
     attachment = db.Column(db.String(200))  # Nome do arquivo
     attachment_type = db.Column(db.String(50))  # image ou pdf
+    attachment_hash = db.Column(db.String(64))  # SHA-256 do anexo (cache da leitura do comprovante)
+    fingerprint = db.Column(db.String(20))  # Origem + valor + descrição normalizada
+    possible_duplicate = db.Column(db.Boolean, default=False)
+    recurring_rule_id = db.Column(db.Integer, db.ForeignKey('recurring_rule.id'), nullable=True)  # Lançada por recorrência
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_transaction_card_date', 'credit_card_id', 'date'),
+        db.Index('ix_transaction_account_date', 'account_id', 'date'),
+        db.Index('ix_transaction_fingerprint', 'user_id', 'fingerprint', 'date'),
+    )
 
 
 class Installment(db.Model):
@@ -158,20 +419,28 @@ class Installment(db.Model):
     credit_card_id = db.Column(db.Integer, db.ForeignKey('credit_card.id'), nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     description = db.Column(db.String(200), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)  # Valor total da compra
-    amount = db.Column(db.Float, nullable=False)  # Valor da parcela
+    total_amount = db.Column(Money, nullable=False)  # Valor total da compra
+    amount = db.Column(Money, nullable=False)  # Valor da parcela
     current_installment = db.Column(db.Integer, nullable=False)  # Parcela atual (1, 2, 3...)
     total_installments = db.Column(db.Integer, nullable=False)  # Total de parcelas
     due_date = db.Column(db.Date, nullable=False)  # Data de vencimento desta parcela
+    invoice_cycle_id = db.Column(db.Integer, db.ForeignKey('invoice_cycle.id'), nullable=True, index=True)  # Fatura (crédito)
     paid = db.Column(db.Boolean, default=False)
     paid_date = db.Column(db.Date)
     purchase_date = db.Column(db.Date, nullable=False)  # Data da compra
     notes = db.Column(db.Text)
+    fingerprint = db.Column(db.String(20))  # Origem + valor total + descrição da compra
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     account = db.relationship('Account', backref='installments')
     credit_card = db.relationship('CreditCard', backref='installments')
     category = db.relationship('Category', backref='installments')
+    invoice_cycle = db.relationship('InvoiceCycle', backref='installments')
+    
+    __table_args__ = (
+        db.Index('ix_installment_fingerprint', 'user_id', 'fingerprint', 'purchase_date'),
+        db.Index('ix_installment_account_paid', 'account_id', 'paid_date'),
+    )
 
 
 class Transfer(db.Model):
@@ -180,11 +449,255 @@ class Transfer(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     from_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     to_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(200))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_transfer_from_date', 'from_account_id', 'date'),
+        db.Index('ix_transfer_to_date', 'to_account_id', 'date'),
+    )
+
+
+class CategoryRule(db.Model):
+    """Regras de categorização automática definidas pelo usuário"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    match_type = db.Column(db.String(20), nullable=False, default='keyword')  # keyword, regex ou any
+    pattern = db.Column(db.String(200))
+    min_amount = db.Column(Money)
+    max_amount = db.Column(Money)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
+    credit_card_id = db.Column(db.Integer, db.ForeignKey('credit_card.id'), nullable=True)
+    priority = db.Column(db.Integer, default=0)  # Menor valor = maior prioridade
+    active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    category = db.relationship('Category', backref=db.backref('rules', cascade='all, delete-orphan'))
+    account = db.relationship('Account')
+    credit_card = db.relationship('CreditCard')
+
+
+class RecurringRule(db.Model):
+    """Lançamentos recorrentes (salário, aluguel, assinaturas), lançados sob demanda até hoje"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
+    credit_card_id = db.Column(db.Integer, db.ForeignKey('credit_card.id'), nullable=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    description = db.Column(db.String(200), nullable=False)
+    amount = db.Column(Money, nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # income ou expense
+    interval_months = db.Column(db.Integer, nullable=False, default=1)  # 1 = mensal, 12 = anual
+    day_of_month = db.Column(db.Integer, nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)
+    next_date = db.Column(db.Date)  # Próxima ocorrência ainda não lançada (None = encerrada)
+    active = db.Column(db.Boolean, default=True)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    account = db.relationship('Account')
+    credit_card = db.relationship('CreditCard')
+    category = db.relationship('Category')
+    
+    __table_args__ = (
+        db.Index('ix_recurring_rule_due', 'user_id', 'next_date'),
+    )
+    
+    def first_occurrence(self):
+        """Primeira ocorrência a partir da data de início"""
+        first = clamp_day(self.start_date.year, self.start_date.month, self.day_of_month)
+        if first < self.start_date:
+            first = clamp_day(*add_months(self.start_date.year, self.start_date.month, 1), self.day_of_month)
+        return first
+    
+    def following(self, occurrence):
+        """Ocorrência seguinte (o dia é sempre recalculado a partir de `day_of_month`)"""
+        return clamp_day(*add_months(occurrence.year, occurrence.month, self.interval_months), self.day_of_month)
+    
+    def occurrences(self, until, start=None):
+        """Ocorrências não lançadas até `until` (inclusive)"""
+        current = self.next_date
+        while current and current <= until and (not self.end_date or current <= self.end_date):
+            if not start or current >= start:
+                yield current
+            current = self.following(current)
+
+
+class Job(db.Model):
+    """Tarefas em segundo plano executadas pelos processos de `flask worker`"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON
+    checkpoint = db.Column(db.Text)  # JSON pequeno: ponto de retomada das tarefas feitas em etapas
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done ou failed
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    message = db.Column(db.String(200))
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_by = db.Column(db.String(50))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_job_queue', 'status', 'run_after'),
+    )
+    
+    @property
+    def label(self):
+        return JOB_LABELS.get(self.kind, self.kind)
+    
+    def report(self, done, total, message=None):
+        """Registra o progresso da tarefa (e confirma o trabalho feito até aqui)"""
+        self.progress = min(100, int(done * 100 / total)) if total else 100
+        self.message = message
+        db.session.commit()
+    
+    def load_checkpoint(self):
+        return json.loads(self.checkpoint or '{}')
+    
+    def save_checkpoint(self, **state):
+        """Guarda onde a tarefa parou (confirmado junto com o próximo `report`)"""
+        self.checkpoint = json.dumps(state)
+
+
+def archive_table(model, *indexes):
+    """Tabela de arquivo com as colunas do modelo; `source_id` guarda o ID original"""
+    return db.Table(
+        f'{model.__tablename__}_archive',
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('source_id', db.Integer, nullable=False),
+        *[db.Column(column.name, column.type, nullable=column.nullable)
+          for column in model.__table__.columns if column.name != 'id'],
+        db.Column('archived_at', db.DateTime),
+        *indexes
+    )
+
+
+# Lançamentos antigos (frios): fora das tabelas consultadas no dia a dia
+transaction_archive = archive_table(
+    Transaction,
+    db.Index('ix_transaction_archive_user_date', 'user_id', 'date'),
+    db.Index('ix_transaction_archive_account_date', 'account_id', 'date')
+)
+installment_archive = archive_table(
+    Installment,
+    db.Index('ix_installment_archive_user_due', 'user_id', 'due_date'),
+    db.Index('ix_installment_archive_account_paid', 'account_id', 'paid_date')
+)
+
+
+class ArchiveSummary(db.Model):
+    """Totais mensais dos lançamentos arquivados, para relatórios sem ler o arquivo"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(20), nullable=False)  # transaction ou installment
+    type = db.Column(db.String(20), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    debit = db.Column(db.Boolean, nullable=False)  # Conta (True) ou cartão (False)
+    total = db.Column(Money, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_archive_summary_period', 'user_id', 'year', 'month'),
+        # Um resumo por grupo; COALESCE porque o SQLite considera NULLs distintos em índices únicos
+        db.Index('uq_archive_summary_group', 'user_id', 'year', 'month', 'source', 'type',
+                 func.coalesce(category_id, literal_column('0')), 'debit', unique=True),
+    )
+
+
+class Budget(db.Model):
+    """Limite mensal de gastos por categoria"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    amount = db.Column(Money, nullable=False)
+    alert_threshold = db.Column(db.Integer, nullable=False, default=80)  # % do limite que dispara o alerta
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    category = db.relationship('Category')
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category_id', name='uq_budget_user_category'),
+    )
+
+
+class SpendCounter(db.Model):
+    """Gasto acumulado por (usuário, categoria, mês), atualizado junto com os lançamentos.
+    
+    Transações de despesa contam no mês da data; parcelas, no mês do vencimento.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    total = db.Column(Money, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category_id', 'year', 'month', name='uq_spend_counter_month'),
+    )
+
+
+class ReceiptScan(db.Model):
+    """Códigos lidos de um comprovante (PIX, boleto, NFC-e), pelo hash do arquivo.
+    
+    O mesmo arquivo nunca é decodificado duas vezes, mesmo anexado a várias transações.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, found, empty ou error
+    kind = db.Column(db.String(20))  # pix, boleto, convenio ou nfce
+    content = db.Column(db.Text)  # Conteúdo bruto do código
+    amount = db.Column(Money)
+    date = db.Column(db.Date)
+    description = db.Column(db.String(200))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    decoded_at = db.Column(db.DateTime)
+    
+    @property
+    def label(self):
+        return RECEIPT_KINDS.get(self.kind)
+    
+    def to_dict(self):
+        return {
+            'hash': self.sha256,
+            'status': self.status,
+            'kind': self.kind,
+            'label': self.label,
+            'amount': str(self.amount) if self.amount is not None else None,
+            'date': self.date.isoformat() if self.date else None,
+            'description': self.description,
+            'error': self.error,
+        }
+
+
+@event.listens_for(Transaction, 'before_insert')
+@event.listens_for(Transaction, 'before_update')
+def set_transaction_fingerprint(mapper, connection, target):
+    target.fingerprint = compute_fingerprint(target.account_id, target.credit_card_id, target.amount, target.description)
+
+
+@event.listens_for(Installment, 'before_insert')
+@event.listens_for(Installment, 'before_update')
+def set_installment_fingerprint(mapper, connection, target):
+    target.fingerprint = compute_fingerprint(
+        target.account_id, target.credit_card_id, target.total_amount, installment_base_description(target.description)
+    )
 
 
 @login_manager.user_loader
@@ -192,110 +705,691 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 
-# ==================== ROTAS BÁSICAS ====================
+# ==================== PARTICIONAMENTO ====================
 
-@app.route('/')
-def index():
-    if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+# Com PARTITION_MODE = user ou bucket, os dados financeiros de cada usuário ficam em um arquivo
+# SQLite próprio (PARTITION_DIR) e usuários diferentes não disputam o mesmo bloqueio de escrita.
+# Todos os arquivos têm o esquema completo; estas tabelas são lidas e gravadas sempre no banco
+# compartilhado (DATABASE_URL), que funciona como catálogo.
+CATALOG_TABLES = {User.__table__, Job.__table__, ReceiptScan.__table__}
 
+_partition_engines = OrderedDict()
+_partition_engines_lock = threading.Lock()
+_UNSET = object()
 
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+
+def partitioned():
+    return app.config['PARTITION_MODE'] != 'off'
+
+
+def partition_key(user_id):
+    """Partição do usuário: uma por usuário ou uma de PARTITION_BUCKETS (pelo resto do ID)"""
+    if app.config['PARTITION_MODE'] == 'user':
+        return f'user_{user_id}'
+    return f'bucket_{user_id % app.config["PARTITION_BUCKETS"]:03d}'
+
+
+def partition_keys():
+    """Partições já criadas em PARTITION_DIR"""
+    if not os.path.isdir(app.config['PARTITION_DIR']):
+        return []
+    return sorted(name[:-3] for name in os.listdir(app.config['PARTITION_DIR']) if name.endswith('.db'))
+
+
+def is_catalog_statement(mapper, clause):
+    """Indica se o comando envolve uma tabela do catálogo (usuários, tarefas, comprovantes)"""
+    if mapper is not None:
+        table = inspect(mapper).local_table
+    elif isinstance(clause, UpdateBase):
+        table = clause.table
+    else:
+        table = clause
+    return table in CATALOG_TABLES
+
+
+def current_partition():
+    """Partição em uso: a definida por `use_partition` ou a do usuário logado na requisição"""
+    if 'partition' in g:
+        return g.partition
+    if has_request_context() and current_user.is_authenticated:
+        return partition_key(current_user.id)
+    return None
+
+
+@contextmanager
+def use_partition(key):
+    """Direciona a sessão para a partição `key` (None = banco compartilhado) dentro do bloco"""
+    previous = g.get('partition', _UNSET)
+    g.partition = key
+    try:
+        yield
+    finally:
+        if previous is _UNSET:
+            g.pop('partition', None)
+        else:
+            g.partition = previous
+
+
+def user_partition(user_id):
+    """Partição de um usuário fora da sua requisição (cadastro, tarefas e comandos)"""
+    return use_partition(partition_key(user_id) if partitioned() and user_id else None)
+
+
+def each_partition():
+    """Percorre os bancos com dados financeiros: cada partição ou, sem particionamento, o compartilhado.
     
-    if request.method == 'POST':
-        username = request.form.get('username')
-        email = request.form.get('email')
-        password = request.form.get('password')
-        
-        if User.query.filter_by(username=username).first():
-            flash('Usuário já existe', 'error')
-            return redirect(url_for('register'))
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email já cadastrado', 'error')
-            return redirect(url_for('register'))
-        
-        user = User(username=username, email=email)
-        user.set_password(password)
-        db.session.add(user)
-        db.session.commit()
+    Confirma e esvazia a sessão entre um e outro: os IDs se repetem entre partições.
+    """
+    for key in (partition_keys() if partitioned() else [None]):
+        with use_partition(key):
+            yield key
+            db.session.commit()
+            db.session.expunge_all()
+
+
+def partition_engine(key):
+    """Engine da partição, mantida em cache LRU; o arquivo é criado com o esquema completo no 1º uso"""
+    with _partition_engines_lock:
+        engine = _partition_engines.get(key)
+        if engine is not None:
+            _partition_engines.move_to_end(key)
+            return engine
         
-        create_default_categories(user.id)
+        path = os.path.join(app.config['PARTITION_DIR'], f'{key}.db')
+        if not os.path.exists(path):
+            create_partition(path)
         
-        flash('Cadastro realizado com sucesso!', 'success')
-        return redirect(url_for('login'))
+        engine = _partition_engines[key] = create_engine(f'sqlite:///{path}', **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        while len(_partition_engines) > app.config['PARTITION_ENGINE_CACHE']:
+            _partition_engines.popitem(last=False)[1].dispose()
+        return engine
+
+
+def create_partition(path):
+    """Cria o arquivo de uma partição já na versão atual do esquema.
     
-    return render_template('register.html')
+    O esquema é montado em um arquivo temporário e publicado com `os.link`, que falha se outro
+    processo tiver criado a mesma partição antes: nunca se vê um arquivo pela metade.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    engine = create_engine(f'sqlite:///{temporary}')
+    try:
+        with engine.begin() as connection:
+            db.metadata.create_all(connection)
+            create_search_index(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}')
+        engine.dispose()
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+    finally:
+        engine.dispose()
+        os.remove(temporary)
 
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+def reset_partition_engines():
+    """Descarta as conexões herdadas do processo pai (após um fork)"""
+    with _partition_engines_lock:
+        for engine in _partition_engines.values():
+            engine.dispose(close=False)
+        _partition_engines.clear()
+
+
+def split_database(purge=False):
+    """Copia os dados financeiros de cada usuário do banco compartilhado para a sua partição.
     
-    if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
-        user = User.query.filter_by(username=username).first()
-        
-        if user and user.check_password(password):
-            login_user(user)
-            return redirect(url_for('dashboard'))
+    A cópia é feita pelo próprio SQLite (ATTACH + INSERT ... SELECT) e mantém os IDs; rodar de
+    novo substitui o que já foi copiado. Com `purge`, os dados copiados saem do banco compartilhado.
+    Retorna {partição: quantidade de usuários}.
+    """
+    source = db.engine.url.database
+    groups = {}
+    for (user_id,) in db.session.query(User.id).order_by(User.id):
+        groups.setdefault(partition_key(user_id), []).append(user_id)
+    
+    tables = [table for table in db.metadata.sorted_tables if table not in CATALOG_TABLES]
+    
+    def owned_by(table, user_ids, schema):
+        """Condição SQL das linhas dos usuários (ciclos de fatura não têm user_id: vão pelo cartão)"""
+        placeholders = ', '.join('?' * len(user_ids))
+        if 'user_id' in table.c:
+            return f'user_id IN ({placeholders})'
+        return f'credit_card_id IN (SELECT id FROM {schema}.credit_card WHERE user_id IN ({placeholders}))'
+    
+    for key, user_ids in groups.items():
+        with partition_engine(key).connect() as connection:
+            # ATTACH não pode acontecer dentro de uma transação: antes do 1º comando de escrita
+            connection.exec_driver_sql('ATTACH DATABASE ? AS shared', (source,))
+            try:
+                for table in reversed(tables):
+                    connection.exec_driver_sql(f'DELETE FROM main."{table.name}" WHERE {owned_by(table, user_ids, "main")}', tuple(user_ids))
+                for table in tables:
+                    columns = ', '.join(f'"{column.name}"' for column in table.columns)
+                    connection.exec_driver_sql(
+                        f'INSERT INTO main."{table.name}" ({columns}) '
+                        f'SELECT {columns} FROM shared."{table.name}" WHERE {owned_by(table, user_ids, "shared")}',
+                        tuple(user_ids)
+                    )
+                connection.commit()
+            finally:
+                connection.exec_driver_sql('DETACH DATABASE shared')
         
-        flash('Usuário ou senha inválidos', 'error')
+        if purge:
+            with db.engine.begin() as connection:
+                for table in reversed(tables):
+                    connection.exec_driver_sql(f'DELETE FROM "{table.name}" WHERE {owned_by(table, user_ids, "main")}', tuple(user_ids))
     
-    return render_template('login.html')
+    return {key: len(user_ids) for key, user_ids in groups.items()}
 
 
-@app.route('/logout')
-@login_required
-def logout():
-    logout_user()
-    return redirect(url_for('login'))
+@app.cli.command('split-db')
+@click.option('--purge', is_flag=True, help='Remove do banco compartilhado os dados copiados')
+def split_db_command(purge):
+    """Divide o banco compartilhado em partições por usuário (PARTITION_MODE=user ou bucket)"""
+    if not partitioned():
+        raise click.UsageError('Defina PARTITION_MODE=user ou PARTITION_MODE=bucket antes de dividir o banco.')
+    
+    init_db()
+    groups = split_database(purge)
+    print(f'{sum(groups.values())} usuário(s) copiado(s) para {len(groups)} partição(ões) em {app.config["PARTITION_DIR"]}.')
 
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    today = datetime.today()
-    current_month = today.month
-    current_year = today.year
+# ==================== TAREFAS EM SEGUNDO PLANO ====================
+
+JOB_HANDLERS = {}
+JOB_LABELS = {}
+
+
+def job_handler(kind, label):
+    """Registra a função que executa as tarefas de um tipo"""
+    def register(function):
+        JOB_HANDLERS[kind] = function
+        JOB_LABELS[kind] = label
+        return function
+    return register
+
+
+def enqueue_job(kind, user_id=None, payload=None, max_attempts=None):
+    """Coloca uma tarefa na fila e retorna imediatamente"""
+    job = Job(
+        kind=kind,
+        user_id=user_id,
+        payload=json.dumps(payload or {}),
+        max_attempts=max_attempts or app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    db.session.commit()
     
-    # Estatísticas do mês
-    month_income = db.session.query(func.sum(Transaction.amount)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.type == 'income',
-        extract('month', Transaction.date) == current_month,
-        extract('year', Transaction.date) == current_year
-    ).scalar() or 0
+    if app.config['JOBS_INLINE']:
+        job.status, job.attempts, job.locked_by, job.locked_at = 'running', 1, 'inline', datetime.utcnow()
+        db.session.commit()
+        run_job(job.id)
     
-    month_expense = db.session.query(func.sum(Transaction.amount)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.type == 'expense',
-        Transaction.account_id.isnot(None),  # Apenas débito
-        extract('month', Transaction.date) == current_month,
-        extract('year', Transaction.date) == current_year
-    ).scalar() or 0
+    return job
+
+
+def claim_next_job(worker):
+    """Reserva atomicamente a próxima tarefa respeitando o limite por usuário; retorna seu ID"""
+    now = datetime.utcnow()
     
-    # Adicionar parcelas pagas do mês
-    month_installments = db.session.query(func.sum(Installment.amount)).filter(
-        Installment.user_id == current_user.id,
-        Installment.paid == True,
-        extract('month', Installment.paid_date) == current_month,
-        extract('year', Installment.paid_date) == current_year,
-        Installment.account_id.isnot(None)  # Apenas débito
-    ).scalar() or 0
+    # Tarefas abandonadas (worker encerrado no meio da execução) voltam para a fila
+    Job.query.filter(
+        Job.status == 'running',
+        Job.locked_at < now - timedelta(seconds=app.config['JOB_TIMEOUT'])
+    ).update({'status': 'queued', 'locked_by': None}, synchronize_session=False)
     
-    month_expense += month_installments
+    candidate, running = aliased(Job), aliased(Job)
+    busy = select(func.count(running.id)).where(
+        running.user_id == candidate.user_id,
+        running.status == 'running'
+    ).scalar_subquery()
     
-    balance = month_income - month_expense
+    next_job = select(candidate.id).where(
+        candidate.status == 'queued',
+        candidate.run_after <= now,
+        or_(candidate.user_id.is_(None), busy < app.config['JOB_MAX_PER_USER'])
+    ).order_by(candidate.run_after, candidate.id).limit(1).scalar_subquery()
     
-    # Contas
-    accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
+    job_id = db.session.execute(
+        update(Job).where(Job.id == next_job, Job.status == 'queued').values(
+            status='running', locked_by=worker, locked_at=now, attempts=Job.attempts + 1
+        ).returning(Job.id)
+    ).scalar()
+    db.session.commit()
+    return job_id
+
+
+def run_job(job_id):
+    """Executa uma tarefa reservada, agendando nova tentativa em caso de erro"""
+    job = db.session.get(Job, job_id)
+    
+    try:
+        handler = JOB_HANDLERS[job.kind]
+        with user_partition(job.user_id):
+            result = handler(job, json.loads(job.payload or '{}'))
+    except Exception as error:
+        db.session.rollback()
+        app.logger.exception('Tarefa %s (%s) falhou', job_id, job.kind)
+        
+        job = db.session.get(Job, job_id)
+        job.error = f'{type(error).__name__}: {error}'
+        if job.kind in JOB_HANDLERS and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+    else:
+        job.status = 'done'
+        job.progress = 100
+        job.result = json.dumps(result)
+        job.finished_at = datetime.utcnow()
+    
+    job.locked_by = job.locked_at = None
+    db.session.commit()
+
+
+def run_worker(burst=False):
+    """Laço de um processo worker: reserva e executa tarefas até ser encerrado"""
+    with app.app_context():
+        # Conexões herdadas do processo pai não podem ser compartilhadas
+        db.engine.dispose(close=False)
+        reset_partition_engines()
+        worker = f'{os.uname().nodename}:{os.getpid()}'
+        
+        while True:
+            job_id = claim_next_job(worker)
+            if job_id is None:
+                if burst:
+                    return
+                time.sleep(app.config['JOB_POLL_INTERVAL'])
+                continue
+            
+            run_job(job_id)
+            db.session.remove()
+
+
+@job_handler('import_statement', 'Importação de extrato')
+def import_statement_job(job, payload):
+    rows = [
+        dict(row, date=date.fromisoformat(row['date']), amount=Decimal(row['amount']))
+        for row in payload['rows']
+    ]
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    checkpoint = job.load_checkpoint()
+    imported, duplicated = checkpoint.get('imported', 0), checkpoint.get('duplicated', 0)
+    
+    # Etapas já confirmadas ficam no checkpoint (o payload com as linhas não é regravado):
+    # uma nova tentativa continua de onde parou
+    for start in range(checkpoint.get('offset', 0), len(rows), chunk_size):
+        counts = import_transactions(
+            job.user_id, rows[start:start + chunk_size],
+            payload.get('account_id'), payload.get('credit_card_id'), payload.get('duplicates', 'skip')
+        )
+        imported, duplicated = imported + counts[0], duplicated + counts[1]
+        job.save_checkpoint(offset=start + chunk_size, imported=imported, duplicated=duplicated)
+        job.report(start + chunk_size, len(rows), f'{imported} importada(s), {duplicated} duplicata(s)')
+    
+    return {'imported': imported, 'duplicated': duplicated}
+
+
+@job_handler('recategorize', 'Recategorização do histórico')
+def recategorize_job(job, payload):
+    updated = recategorize_history(job.user_id, overwrite=payload.get('overwrite', False))
+    job.message = f'{updated} lançamento(s) recategorizado(s)'
+    return {'updated': updated}
+
+
+@job_handler('rebuild_invoice_totals', 'Recálculo de faturas')
+def rebuild_invoice_totals_job(job, payload):
+    cards = CreditCard.query.filter_by(user_id=job.user_id).all()
+    if payload.get('credit_card_id'):
+        cards = [card for card in cards if card.id == payload['credit_card_id']]
+    
+    for done, card in enumerate(cards, start=1):
+        cycles = InvoiceCycle.query.filter(
+            InvoiceCycle.credit_card_id == card.id,
+            InvoiceCycle.closing_date <= date.today()
+        ).all()
+        for cycle in cycles:
+            cycle.total = cycle.total_computed_at = None
+        card.get_cycle_totals(cycles)
+        job.report(done, len(cards), card.name)
+    
+    return {'cards': len(cards)}
+
+
+@app.route('/jobs')
+@login_required
+def jobs():
+    jobs_list = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).limit(50).all()
+    return render_template('jobs.html', jobs=jobs_list)
+
+
+@app.route('/job/<int:id>')
+@login_required
+def job_status(id):
+    """Estado de uma tarefa (para acompanhamento via JavaScript)"""
+    job = Job.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error if job.status == 'failed' else None
+    })
+
+
+@app.cli.command('worker')
+@click.option('--processes', type=int, default=None, help='Número de processos (padrão: JOB_WORKERS)')
+@click.option('--burst', is_flag=True, help='Encerra quando a fila estiver vazia')
+def worker_command(processes, burst):
+    """Inicia os processos que executam as tarefas em segundo plano"""
+    def start():
+        process = multiprocessing.Process(target=run_worker, args=(burst,))
+        process.start()
+        return process
+    
+    workers = [start() for _ in range(processes or app.config['JOB_WORKERS'])]
+    print(f'{len(workers)} worker(s) iniciado(s).')
+    
+    try:
+        while workers:
+            time.sleep(1)
+            # Reinicia processos que morreram inesperadamente
+            workers = [
+                process if process.is_alive() else start()
+                for process in workers
+                if process.is_alive() or not (burst or process.exitcode == 0)
+            ]
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+
+
+# ==================== ARQUIVOS ESTÁTICOS ====================
+
+# Gerados por `python build_assets.py`; sem o manifesto, os templates usam as CDNs
+ASSET_DIST_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_CDN = {
+    'fontawesome.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'chart.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.7/dist/chart.umd.min.js',
+}
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json'}
+
+
+def load_asset_manifest():
+    """Nome lógico -> arquivo com hash em static/dist"""
+    try:
+        with open(os.path.join(ASSET_DIST_DIR, 'manifest.json')) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+ASSET_MANIFEST = load_asset_manifest()
+
+
+@app.template_global()
+def asset_built(name):
+    return name in ASSET_MANIFEST
+
+
+@app.template_global()
+def asset_url(name):
+    """URL versionada do arquivo gerado ou, se ainda não foi gerado, da CDN"""
+    if name in ASSET_MANIFEST:
+        return url_for('dist_asset', filename=ASSET_MANIFEST[name])
+    return ASSET_CDN[name]
+
+
+@app.route('/static/dist/<path:filename>')
+def dist_asset(filename):
+    """Arquivos com hash no nome: imutáveis e servidos pré-comprimidos quando o cliente aceita"""
+    options = {'mimetype': mimetypes.guess_type(filename)[0], 'max_age': 365 * 24 * 3600}
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(ASSET_DIST_DIR, filename + suffix)):
+            response = send_from_directory(ASSET_DIST_DIR, filename + suffix, **options)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename, **options)
+    
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Comprime páginas HTML e respostas JSON com gzip (respostas em streaming seguem sem compressão)"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not request.accept_encodings['gzip']):
+        return response
+    
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# ==================== SENHAS ====================
+
+# Calcular um hash de senha é caro de propósito. Cada cálculo ocupa uma de PASSWORD_HASH_CONCURRENCY
+# vagas (arquivos travados com flock, somando todos os processos). Quem não consegue vaga em
+# PASSWORD_HASH_WAIT segundos recebe 503 na hora: uma rajada de logins usa no máximo essa parte da
+# CPU e, como a espera é curta, também não deixa os workers parados aguardando vaga.
+
+class PasswordHashBusy(Exception):
+    """Nenhuma vaga livre para calcular o hash dentro de PASSWORD_HASH_WAIT"""
+
+
+_password_semaphore = None
+_password_semaphore_lock = threading.Lock()
+_password_methods = {}
+
+
+def password_hash_method():
+    """Política atual por extenso, como fica gravada no hash (ex.: 'pbkdf2' -> 'pbkdf2:sha256:600000')"""
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method not in _password_methods:
+        # Um hash de teste por processo: o Werkzeug completa os parâmetros omitidos com os padrões
+        _password_methods[method] = generate_password_hash('', method, salt_length=1).split('$', 1)[0]
+    return _password_methods[method]
+
+
+def password_semaphore():
+    """Vagas por processo, usadas quando não há flock (Windows)"""
+    global _password_semaphore
+    with _password_semaphore_lock:
+        if _password_semaphore is None:
+            _password_semaphore = threading.BoundedSemaphore(app.config['PASSWORD_HASH_CONCURRENCY'])
+        return _password_semaphore
+
+
+@contextmanager
+def password_hash_slot():
+    """Ocupa uma vaga de cálculo de hash enquanto o bloco executa; PasswordHashBusy se não houver vaga a tempo"""
+    deadline = time.monotonic() + app.config['PASSWORD_HASH_WAIT']
+    
+    if fcntl is None:
+        semaphore = password_semaphore()
+        if not semaphore.acquire(timeout=app.config['PASSWORD_HASH_WAIT']):
+            raise PasswordHashBusy()
+        try:
+            yield
+        finally:
+            semaphore.release()
+        return
+    
+    os.makedirs(app.config['PASSWORD_SLOT_DIR'], exist_ok=True)
+    while True:
+        for slot in range(app.config['PASSWORD_HASH_CONCURRENCY']):
+            handle = open(os.path.join(app.config['PASSWORD_SLOT_DIR'], f'{slot}.lock'), 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            try:
+                yield
+            finally:
+                handle.close()  # Fechar o arquivo libera a trava
+            return
+        
+        if time.monotonic() >= deadline:
+            raise PasswordHashBusy()
+        time.sleep(0.01)
+
+
+def run_password_hash(function, *args):
+    """Executa `function` (gerar ou verificar um hash) dentro de uma vaga"""
+    with password_hash_slot():
+        return function(*args)
+
+
+def password_busy_response(template):
+    flash('Muitos acessos ao mesmo tempo. Tente novamente em instantes.', 'error')
+    return render_template(template), 503, {'Retry-After': '1'}
+
+
+# ==================== ROTAS BÁSICAS ====================
+
+@app.route('/')
+def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('login'))
+
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        username = request.form.get('username')
+        email = request.form.get('email')
+        password = request.form.get('password')
+        
+        if User.query.filter_by(username=username).first():
+            flash('Usuário já existe', 'error')
+            return redirect(url_for('register'))
+        
+        if User.query.filter_by(email=email).first():
+            flash('Email já cadastrado', 'error')
+            return redirect(url_for('register'))
+        
+        user = User(username=username, email=email)
+        try:
+            user.set_password(password)
+        except PasswordHashBusy:
+            return password_busy_response('register.html')
+        db.session.add(user)
+        db.session.commit()
+        
+        with user_partition(user.id):
+            create_default_categories(user.id)
+        
+        flash('Cadastro realizado com sucesso!', 'success')
+        return redirect(url_for('login'))
+    
+    return render_template('register.html')
+
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        user = User.query.filter_by(username=username).first()
+        
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except PasswordHashBusy:
+            return password_busy_response('login.html')
+        
+        if authenticated:
+            # Hash de outra política (mais fraca ou mais cara que a atual): refazer agora que a senha é conhecida
+            if user.password_needs_rehash:
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except PasswordHashBusy:
+                    pass  # Fica para o próximo login
+            login_user(user)
+            materialize_recurring(user.id)
+            return redirect(url_for('dashboard'))
+        
+        flash('Usuário ou senha inválidos', 'error')
+    
+    return render_template('login.html')
+
+
+@app.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('login'))
+
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    today = datetime.today()
+    current_month = today.month
+    current_year = today.year
+    
+    # Lançar recorrências vencidas desde a última visita (sessões lembradas duram dias)
+    materialize_recurring(current_user.id)
+    
+    # Estatísticas do mês
+    month_income = db.session.query(func.sum(Transaction.amount)).filter(
+        Transaction.user_id == current_user.id,
+        Transaction.type == 'income',
+        extract('month', Transaction.date) == current_month,
+        extract('year', Transaction.date) == current_year
+    ).scalar() or 0
+    
+    month_expense = db.session.query(func.sum(Transaction.amount)).filter(
+        Transaction.user_id == current_user.id,
+        Transaction.type == 'expense',
+        Transaction.account_id.isnot(None),  # Apenas débito
+        extract('month', Transaction.date) == current_month,
+        extract('year', Transaction.date) == current_year
+    ).scalar() or 0
+    
+    # Adicionar parcelas pagas do mês
+    month_installments = db.session.query(func.sum(Installment.amount)).filter(
+        Installment.user_id == current_user.id,
+        Installment.paid == True,
+        extract('month', Installment.paid_date) == current_month,
+        extract('year', Installment.paid_date) == current_year,
+        Installment.account_id.isnot(None)  # Apenas débito
+    ).scalar() or 0
+    
+    month_expense += month_installments
+    
+    balance = month_income - month_expense
+    
+    # Contas
+    accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
     total_accounts = sum(acc.current_balance for acc in accounts)
     
     # Cartões de crédito
@@ -341,6 +1435,22 @@ def dashboard():
         
         future_commitment += commitment
     
+    # Recorrências futuras: projetadas direto das regras, sem lançamentos antecipados
+    future_recurring = sum(
+        amount for day, type, amount in project_recurring(
+            current_user.id,
+            date(*add_months(today.year, today.month, 1), 1),
+            date(*add_months(today.year, today.month, 4), 1) - timedelta(days=1)
+        )
+        if type == 'expense'
+    )
+    
+    # Orçamentos que passaram do limite de alerta no mês
+    budget_alerts = [
+        budget for budget in budget_status(current_user.id, current_year, current_month)
+        if budget.status != 'ok'
+    ]
+    
     return render_template('dashboard.html',
                          month_income=month_income,
                          month_expense=month_expense,
@@ -352,6 +1462,8 @@ def dashboard():
                          expenses_by_category=expenses_by_category,
                          pending_installments=pending_installments,
                          future_commitment=future_commitment,
+                         future_recurring=future_recurring,
+                         budget_alerts=budget_alerts,
                          current_month=current_month,
                          current_year=current_year)
 
@@ -366,27 +1478,60 @@ def transactions():
     type_filter = request.args.get('type')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    search = request.args.get('q', '').strip()
+    
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+    
+    def filtered(table, search_kind):
+        t = table.c
+        query = transaction_rows_query(table).where(t.user_id == current_user.id)
+        
+        if account_filter:
+            query = query.where(t.account_id == account_filter)
+        if category_filter:
+            query = query.where(t.category_id == category_filter)
+        if type_filter:
+            query = query.where(t.type == type_filter)
+        if start_date:
+            query = query.where(t.date >= start_date)
+        if end_date:
+            query = query.where(t.date <= end_date)
+        
+        # Busca textual (FTS5): resultados ordenados por relevância
+        if search:
+            matches = search_matches(current_user.id, search, search_kind)
+            query = query.join(matches, matches.c.id == t.id).add_columns(matches.c.rank)
+        return query
     
-    query = Transaction.query.filter_by(user_id=current_user.id)
+    # O arquivo só entra na consulta quando o período pedido chega até ele
+    queries = [filtered(Transaction.__table__, SEARCH_KIND_TRANSACTION)]
+    if reaches_archive(current_user, start_date):
+        queries.append(filtered(transaction_archive, SEARCH_KIND_TRANSACTION_ARCHIVE))
     
-    if account_filter:
-        query = query.filter_by(account_id=account_filter)
-    if category_filter:
-        query = query.filter_by(category_id=category_filter)
-    if type_filter:
-        query = query.filter_by(type=type_filter)
-    if start_date:
-        query = query.filter(Transaction.date >= datetime.strptime(start_date, '%Y-%m-%d').date())
-    if end_date:
-        query = query.filter(Transaction.date <= datetime.strptime(end_date, '%Y-%m-%d').date())
+    transactions_list = execute_rows(
+        queries, lambda c: (c.rank,) if search else (c.date.desc(), c.created_at.desc())
+    )
     
-    transactions_list = query.order_by(Transaction.date.desc(), Transaction.created_at.desc()).all()
+    matched_installments = []
+    if search:
+        sources = [(Installment.__table__, SEARCH_KIND_INSTALLMENT)]
+        if reaches_archive(current_user):
+            sources.append((installment_archive, SEARCH_KIND_INSTALLMENT_ARCHIVE))
+        
+        queries = []
+        for table, search_kind in sources:
+            matches = search_matches(current_user.id, search, search_kind)
+            queries.append(installment_rows_query(table).join(matches, matches.c.id == table.c.id).add_columns(matches.c.rank))
+        matched_installments = execute_rows(queries, lambda c: (c.rank,), limit=50)
     
     accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
     categories = Category.query.filter_by(user_id=current_user.id).all()
     
     return render_template('transactions.html',
                          transactions=transactions_list,
+                         matched_installments=matched_installments,
+                         search=search,
                          accounts=accounts,
                          categories=categories)
 
@@ -420,22 +1565,10 @@ def add_transaction():
 
 def create_simple_transaction(form_data, payment_method):
     """Cria uma transação simples"""
-    # Upload de anexo
-    attachment_filename = None
-    attachment_type = None
-    
-    if 'attachment' in request.files:
-        file = request.files['attachment']
-        if file and file.filename:
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            attachment_filename = f"{timestamp}_{filename}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], attachment_filename))
-            
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                attachment_type = 'image'
-            elif filename.lower().endswith('.pdf'):
-                attachment_type = 'pdf'
+    # Upload de anexo (ou o comprovante já enviado para leitura)
+    attachment_filename, attachment_type, attachment_hash = save_attachment(
+        request.files.get('attachment'), form_data.get('attachment_hash')
+    )
     
     transaction = Transaction(
         user_id=current_user.id,
@@ -443,16 +1576,32 @@ def create_simple_transaction(form_data, payment_method):
         credit_card_id=int(form_data.get('credit_card_id')) if payment_method == 'credit' else None,
         category_id=form_data.get('category_id') or None,
         description=form_data.get('description'),
-        amount=float(form_data.get('amount')),
+        amount=parse_money(form_data.get('amount')),
         type=form_data.get('type'),
         date=datetime.strptime(form_data.get('date'), '%Y-%m-%d').date(),
         notes=form_data.get('notes'),
         attachment=attachment_filename,
-        attachment_type=attachment_type
+        attachment_type=attachment_type,
+        attachment_hash=attachment_hash
     )
     
+    # Categorização automática por regras
+    if not transaction.category_id:
+        transaction.category_id = get_rule_matcher(current_user.id).match(
+            transaction.description, transaction.amount, transaction.account_id, transaction.credit_card_id
+        )
+    
+    # Aviso de possível lançamento em duplicidade (antes de incluir na sessão)
+    duplicated = find_duplicates(current_user.id, [{
+        'fingerprint': compute_fingerprint(transaction.account_id, transaction.credit_card_id, transaction.amount, transaction.description),
+        'date': transaction.date,
+    }])
+    
     db.session.add(transaction)
     
+    if transaction.type == 'expense':
+        record_spending([(current_user.id, transaction.category_id, transaction.date, transaction.amount)])
+    
     # Atualizar saldo da conta (apenas débito)
     if payment_method == 'debit':
         account = Account.query.get(transaction.account_id)
@@ -460,37 +1609,71 @@ def create_simple_transaction(form_data, payment_method):
             account.current_balance += transaction.amount
         else:
             account.current_balance -= transaction.amount
+    else:
+        invalidate_invoice_totals(transaction.credit_card_id, dates=[transaction.date])
     
     db.session.commit()
+    if attachment_type == 'image':
+        scan_receipts([(attachment_hash, attachment_filename)], current_user.id)
+    
     flash('Transação adicionada com sucesso!', 'success')
+    if duplicated:
+        flash('Atenção: já existe um lançamento igual em datas próximas. Verifique se não é duplicado.', 'warning')
     return redirect(url_for('transactions'))
 
 
 def create_installment_purchase(form_data, payment_method):
     """Cria parcelas de uma compra parcelada"""
     description = form_data.get('description')
-    total_amount = float(form_data.get('amount'))
+    total_amount = parse_money(form_data.get('amount'))
     installments_count = int(form_data.get('installments_count'))
     purchase_date = datetime.strptime(form_data.get('date'), '%Y-%m-%d').date()
     
-    installment_amount = total_amount / installments_count
+    # Parcelas exatas em centavos (ex.: 8000/15 = 5x 533,34 + 10x 533,33)
+    installment_amounts = split_amount(total_amount, installments_count)
+    
+    account_id = int(form_data.get('account_id')) if payment_method == 'debit' else None
+    credit_card_id = int(form_data.get('credit_card_id')) if payment_method == 'credit' else None
+    
+    # Categorização automática por regras
+    category_id = form_data.get('category_id') or get_rule_matcher(current_user.id).match(
+        description, total_amount, account_id, credit_card_id
+    )
+    
+    # Aviso de possível compra parcelada em duplicidade
+    duplicated = find_duplicates(current_user.id, [{
+        'fingerprint': compute_fingerprint(account_id, credit_card_id, total_amount, description),
+        'date': purchase_date,
+    }], model=Installment)
+    
+    # No crédito, cada parcela cai em um ciclo de fatura consecutivo do cartão
+    cycles = None
+    if payment_method == 'credit':
+        card = CreditCard.query.filter_by(id=credit_card_id, user_id=current_user.id).first_or_404()
+        cycles = card.get_following_cycles(card.get_invoice_cycle(purchase_date), installments_count)
     
     # Criar cada parcela
+    due_dates = []
     for i in range(installments_count):
         # Calcular data de vencimento
-        due_date = purchase_date + timedelta(days=30 * i)
+        if cycles:
+            due_date = cycles[i].due_date
+        else:
+            due_date = purchase_date + timedelta(days=30 * i)
+        due_dates.append(due_date)
         
         installment = Installment(
             user_id=current_user.id,
-            account_id=int(form_data.get('account_id')) if payment_method == 'debit' else None,
-            credit_card_id=int(form_data.get('credit_card_id')) if payment_method == 'credit' else None,
-            category_id=form_data.get('category_id') or None,
+            account_id=account_id,
+            credit_card_id=credit_card_id,
+            category_id=category_id,
             description=f"{description} - Parcela {i+1}/{installments_count}",
             total_amount=total_amount,
-            amount=installment_amount,
+            amount=installment_amounts[i],
             current_installment=i + 1,
             total_installments=installments_count,
             due_date=due_date,
+            invoice_cycle_id=cycles[i].id if cycles else None,
             purchase_date=purchase_date,
             notes=form_data.get('notes')
         )
@@ -502,12 +1685,19 @@ def create_installment_purchase(form_data, payment_method):
             
             # Atualizar saldo da conta
             account = Account.query.get(installment.account_id)
-            account.current_balance -= installment_amount
+            account.current_balance -= installment_amounts[0]
         
         db.session.add(installment)
     
+    record_spending((current_user.id, category_id, due_date, amount) for due_date, amount in zip(due_dates, installment_amounts))
+    
+    if cycles:
+        invalidate_invoice_totals(card.id, cycle_ids=[cycle.id for cycle in cycles])
+    
     db.session.commit()
     flash(f'Compra parcelada em {installments_count}x criada com sucesso!', 'success')
+    if duplicated:
+        flash('Atenção: já existe uma compra parcelada igual em datas próximas. Verifique se não é duplicada.', 'warning')
     return redirect(url_for('installments_list'))
 
 
@@ -525,33 +1715,30 @@ def edit_transaction(id):
             else:
                 account.current_balance += transaction.amount
         
+        # Estornar dos contadores de gastos (relançado abaixo com os novos dados)
+        if transaction.type == 'expense':
+            record_spending([(current_user.id, transaction.category_id, transaction.date, transaction.amount)], sign=-1)
+        
         # Atualizar transação
         old_account_id = transaction.account_id
+        old_card_id, old_date = transaction.credit_card_id, transaction.date
         payment_method = request.form.get('payment_method')
         
         transaction.account_id = int(request.form.get('account_id')) if payment_method == 'debit' else None
         transaction.credit_card_id = int(request.form.get('credit_card_id')) if payment_method == 'credit' else None
         transaction.category_id = request.form.get('category_id') or None
         transaction.description = request.form.get('description')
-        transaction.amount = float(request.form.get('amount'))
+        transaction.amount = parse_money(request.form.get('amount'))
         transaction.type = request.form.get('type')
         transaction.date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
         transaction.notes = request.form.get('notes')
         
         # Upload de novo anexo
-        if 'attachment' in request.files:
-            file = request.files['attachment']
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                attachment_filename = f"{timestamp}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], attachment_filename))
-                
-                transaction.attachment = attachment_filename
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    transaction.attachment_type = 'image'
-                elif filename.lower().endswith('.pdf'):
-                    transaction.attachment_type = 'pdf'
+        attachment_filename, attachment_type, attachment_hash = save_attachment(request.files.get('attachment'))
+        if attachment_filename:
+            transaction.attachment = attachment_filename
+            transaction.attachment_type = attachment_type
+            transaction.attachment_hash = attachment_hash
         
         # Aplicar novo saldo (apenas débito)
         if payment_method == 'debit' and transaction.account_id:
@@ -563,7 +1750,16 @@ def edit_transaction(id):
             else:
                 account.current_balance -= transaction.amount
         
+        if transaction.type == 'expense':
+            record_spending([(current_user.id, transaction.category_id, transaction.date, transaction.amount)])
+        
+        invalidate_invoice_totals(old_card_id, dates=[old_date])
+        invalidate_invoice_totals(transaction.credit_card_id, dates=[transaction.date])
+        
         db.session.commit()
+        if attachment_type == 'image':
+            scan_receipts([(attachment_hash, attachment_filename)], current_user.id)
+        
         flash('Transação atualizada com sucesso!', 'success')
         return redirect(url_for('transactions'))
     
@@ -571,8 +1767,13 @@ def edit_transaction(id):
     credit_cards = CreditCard.query.filter_by(user_id=current_user.id, active=True).all()
     categories = Category.query.filter_by(user_id=current_user.id).all()
     
+    receipt = None
+    if transaction.attachment_hash:
+        receipt = ReceiptScan.query.filter_by(sha256=transaction.attachment_hash).first()
+    
     return render_template('edit_transaction.html', 
                          transaction=transaction,
+                         receipt=receipt,
                          accounts=accounts,
                          credit_cards=credit_cards,
                          categories=categories)
@@ -591,6 +1792,11 @@ def delete_transaction(id):
         else:
             account.current_balance += transaction.amount
     
+    if transaction.type == 'expense':
+        record_spending([(current_user.id, transaction.category_id, transaction.date, transaction.amount)], sign=-1)
+    
+    invalidate_invoice_totals(transaction.credit_card_id, dates=[transaction.date])
+    
     # Remover arquivo anexo se existir
     if transaction.attachment:
         try:
@@ -612,53 +1818,651 @@ def view_attachment(filename):
     return send_file(os.path.join(app.config['UPLOAD_FOLDER'], filename))
 
 
-# ==================== PARCELAS ====================
+# ==================== COMPROVANTES ====================
 
-@app.route('/installments')
-@login_required
-def installments_list():
-    status_filter = request.args.get('status', 'pending')
+RECEIPT_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+RECEIPT_STAGING_DIR = os.path.join(app.config['UPLOAD_FOLDER'], 'receipts')  # Enviados antes de salvar a transação
+os.makedirs(RECEIPT_STAGING_DIR, exist_ok=True)
+
+RECEIPT_KINDS = {'pix': 'PIX', 'boleto': 'Boleto', 'convenio': 'Conta/tributo', 'nfce': 'NFC-e'}
+
+# O fator de vencimento conta dias desde 07/10/1997 e voltou a 1000 em 22/02/2025
+BOLETO_FACTOR_BASES = (date(1997, 10, 7), date(2022, 5, 29))
+BOLETO_BANKS = {
+    '001': 'Banco do Brasil', '033': 'Santander', '077': 'Inter', '104': 'Caixa', '237': 'Bradesco',
+    '260': 'Nubank', '336': 'C6 Bank', '341': 'Itaú', '748': 'Sicredi', '756': 'Sicoob',
+}
+CONVENIO_SEGMENTS = {
+    '1': 'Prefeitura', '2': 'Saneamento', '3': 'Energia elétrica e gás', '4': 'Telecomunicações',
+    '5': 'Órgão governamental', '6': 'Carnê', '7': 'Multa de trânsito',
+}
+
+
+def attachment_kind(filename):
+    """Tipo do anexo pela extensão: image, pdf ou None"""
+    filename = filename.lower()
+    if filename.endswith(RECEIPT_IMAGE_EXTENSIONS):
+        return 'image'
+    if filename.endswith('.pdf'):
+        return 'pdf'
+    return None
+
+
+def staged_receipt(sha256):
+    """Caminho do comprovante enviado para leitura com esse hash, se existir"""
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256 or ''):
+        return None
+    for extension in RECEIPT_IMAGE_EXTENSIONS:
+        path = os.path.join(RECEIPT_STAGING_DIR, sha256 + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def save_attachment(file, staged_hash=None):
+    """Grava o anexo enviado e retorna (arquivo, tipo, SHA-256), ou (None, None, None) sem anexo.
     
-    query = Installment.query.filter_by(user_id=current_user.id)
+    Sem arquivo no formulário, usa o comprovante já enviado para leitura com `staged_hash`.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
-    if status_filter == 'pending':
-        query = query.filter_by(paid=False)
-    elif status_filter == 'paid':
-        query = query.filter_by(paid=True)
+    if not (file and file.filename):
+        staged = staged_receipt(staged_hash)
+        if not staged:
+            return None, None, None
+        attachment_filename = f"{timestamp}_comprovante{os.path.splitext(staged)[1]}"
+        try:
+            os.link(staged, os.path.join(app.config['UPLOAD_FOLDER'], attachment_filename))
+        except OSError:
+            shutil.copyfile(staged, os.path.join(app.config['UPLOAD_FOLDER'], attachment_filename))
+        return attachment_filename, 'image', staged_hash
     
-    installments = query.order_by(Installment.due_date.asc()).all()
+    data = file.read()
+    filename = secure_filename(file.filename)
+    attachment_filename = f"{timestamp}_{filename}"
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], attachment_filename), 'wb') as output:
+        output.write(data)
     
-    return render_template('installments.html', installments=installments, status_filter=status_filter)
+    return attachment_filename, attachment_kind(filename), hashlib.sha256(data).hexdigest()
 
 
-@app.route('/installment/pay/<int:id>', methods=['POST'])
-@login_required
-def pay_installment(id):
-    installment = Installment.query.filter_by(id=id, user_id=current_user.id).first_or_404()
-    
-    if installment.paid:
-        flash('Parcela já foi paga!', 'warning')
-        return redirect(url_for('installments_list'))
+def register_receipts(hashes, include_pending=False):
+    """Cria as leituras que faltam e retorna os hashes a decodificar: os novos e os que falharam
+    (com `include_pending`, também os que já aguardam outra tarefa)
+    """
+    hashes = list(dict.fromkeys(hashes))
+    if not hashes:
+        return set()
     
-    installment.paid = True
-    installment.paid_date = datetime.today().date()
+    known = dict(db.session.query(ReceiptScan.sha256, ReceiptScan.status).filter(ReceiptScan.sha256.in_(hashes)).all())
+    new = [sha256 for sha256 in hashes if sha256 not in known]
+    if new:
+        db.session.execute(
+            sqlite_insert(ReceiptScan).values([{'sha256': sha256} for sha256 in new])
+            .on_conflict_do_nothing(index_elements=['sha256'])
+        )
     
-    # Atualizar saldo da conta (se for débito)
-    if installment.account_id:
-        account = Account.query.get(installment.account_id)
-        account.current_balance -= installment.amount
+    retry = ('pending', 'error') if include_pending else ('error',)
+    return set(new) | {sha256 for sha256, status in known.items() if status in retry}
+
+
+def scan_receipts(files, user_id=None):
+    """Agenda a leitura dos comprovantes ainda não decodificados.
     
+    `files` = [(SHA-256, caminho relativo a UPLOAD_FOLDER)]. Retorna a tarefa, ou None se
+    todos já estiverem no cache.
+    """
+    pending = register_receipts(sha256 for sha256, _ in files)
     db.session.commit()
-    flash('Parcela paga com sucesso!', 'success')
-    return redirect(url_for('installments_list'))
+    
+    files = dict(files)
+    if not pending:
+        return None
+    return enqueue_job('scan_receipts', user_id, {'files': [[sha256, files[sha256]] for sha256 in pending]})
 
 
-@app.route('/installment/unpay/<int:id>', methods=['POST'])
-@login_required
-def unpay_installment(id):
-    installment = Installment.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+def decode_receipt_image(path, max_side):
+    """Lê os códigos (QR e barras) de uma imagem; executada nos processos do pool.
     
-    if not installment.paid:
+    Passadas da mais barata à mais cara, parando na primeira que encontrar algo: reduzida em
+    tons de cinza, reduzida com contraste ajustado e, por fim, na resolução original.
+    """
+    # Importados só aqui: a aplicação funciona sem a libzbar instalada
+    from PIL import Image, ImageOps
+    from pyzbar.pyzbar import decode, ZBarSymbol
+    
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert('L')
+    
+    small = image.copy()
+    small.thumbnail((max_side, max_side))
+    passes = [small, ImageOps.autocontrast(small, cutoff=2)]
+    if small.size != image.size:
+        passes.append(image)
+    
+    symbols = [ZBarSymbol.QRCODE, ZBarSymbol.I25, ZBarSymbol.CODE128]
+    for candidate in passes:
+        found = decode(candidate, symbols=symbols)
+        if found:
+            return [(symbol.type, symbol.data.decode('utf-8', 'replace')) for symbol in found]
+    return []
+
+
+_receipt_pool = None
+
+
+def receipt_pool():
+    """Pool de processos da leitura de comprovantes, criado sob demanda em cada worker"""
+    global _receipt_pool
+    if _receipt_pool is None:
+        _receipt_pool = ProcessPoolExecutor(max_workers=app.config['RECEIPT_DECODE_PROCESSES'])
+    return _receipt_pool
+
+
+def discard_receipt_pool():
+    """Encerra o pool atual à força, matando seus processos; o próximo é criado sob demanda"""
+    global _receipt_pool
+    pool, _receipt_pool = _receipt_pool, None
+    if pool is None:
+        return
+    processes = list((pool._processes or {}).values())  # shutdown() descarta a referência
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def decode_receipts(paths):
+    """Decodifica as imagens em paralelo no pool; retorna [(códigos, erro)] na ordem de `paths`"""
+    results = {}
+    pending = list(range(len(paths)))
+    
+    while pending:
+        pool = receipt_pool()
+        futures = [(index, pool.submit(decode_receipt_image, paths[index], app.config['RECEIPT_MAX_SIDE'])) for index in pending]
+        pending = []
+        
+        for position, (index, future) in enumerate(futures):
+            if not wait_futures([future], timeout=app.config['RECEIPT_DECODE_TIMEOUT']).done:
+                results[index] = ([], f'Leitura interrompida após {app.config["RECEIPT_DECODE_TIMEOUT"]}s')
+                # O processo travado seguraria a vaga do pool para sempre: descartar o pool e
+                # refazer, em um pool novo, as leituras que ainda não tinham terminado
+                remaining = futures[position + 1:]
+                pending = [other for other, other_future in remaining if not other_future.done()]
+                finished = [(other, other_future) for other, other_future in remaining if other_future.done()]
+                discard_receipt_pool()
+                for other, other_future in finished:
+                    results[other] = receipt_outcome(other_future)
+                break
+            
+            results[index] = receipt_outcome(future)
+    
+    return [results[index] for index in range(len(paths))]
+
+
+def receipt_outcome(future):
+    """(códigos, erro) de uma leitura concluída"""
+    try:
+        return future.result(), None
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: falha na libzbar): o pool é recriado na próxima leitura
+        discard_receipt_pool()
+        return [], 'O processo de leitura foi encerrado inesperadamente'
+    except Exception as error:
+        return [], f'{type(error).__name__}: {error}'
+
+
+def parse_emv(payload):
+    """Campos TLV (ID de 2 dígitos, tamanho de 2 dígitos, valor) do padrão EMV usado no PIX"""
+    fields, position = {}, 0
+    while position + 4 <= len(payload):
+        size = int(payload[position + 2:position + 4])
+        fields[payload[position:position + 2]] = payload[position + 4:position + 4 + size]
+        position += 4 + size
+    return fields
+
+
+def crc16_ccitt(data):
+    """CRC16-CCITT (polinômio 0x1021, inicial 0xFFFF) que fecha o código PIX"""
+    crc = 0xFFFF
+    for byte in data.encode('utf-8'):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+def modulo10(digits):
+    """Dígito verificador módulo 10 (pesos 2 e 1 da direita para a esquerda)"""
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        product = int(digit) * (2 - position % 2)
+        total += product // 10 + product % 10
+    return (10 - total % 10) % 10
+
+
+def modulo11(digits):
+    """Resto do módulo 11 com pesos de 2 a 9 da direita para a esquerda"""
+    return sum(int(digit) * (2 + position % 8) for position, digit in enumerate(reversed(digits))) % 11
+
+
+def parse_pix(content):
+    """PIX copia e cola: valor (campo 54) e recebedor (campo 59), validados pelo CRC"""
+    if content[-8:-4] != '6304' or f'{crc16_ccitt(content[:-4]):04X}' != content[-4:].upper():
+        return None
+    
+    fields = parse_emv(content)
+    if parse_emv(fields.get('26', '')).get('00', '').lower() != 'br.gov.bcb.pix':
+        return None
+    
+    return {
+        'kind': 'pix',
+        'amount': parse_money(fields.get('54')),
+        'date': None,
+        'description': fields.get('59', '').strip() or 'PIX',
+    }
+
+
+def parse_boleto(digits):
+    """Boleto bancário ou de convênio (contas e tributos), pelo código de barras ou linha digitável"""
+    if len(digits) == 47:
+        digits = digits[0:4] + digits[32] + digits[33:47] + digits[4:9] + digits[10:20] + digits[21:31]
+    elif len(digits) == 48:
+        digits = ''.join(digits[start:start + 11] for start in range(0, 48, 12))
+    
+    # Convênio: identificador 6/8 = valor em reais (módulo 10/11), 7/9 = quantidade de referência
+    if digits[0] == '8':
+        rest = modulo11(digits[:3] + digits[4:])
+        check = modulo10(digits[:3] + digits[4:]) if digits[2] in '67' else (0 if rest in (0, 1) else 11 - rest)
+        if int(digits[3]) != check:
+            return None
+        return {
+            'kind': 'convenio',
+            'amount': Decimal(int(digits[4:15])).scaleb(-2) if digits[2] in '68' else None,
+            'date': None,
+            'description': CONVENIO_SEGMENTS.get(digits[1], 'Conta/tributo'),
+        }
+    
+    check = 11 - modulo11(digits[:4] + digits[5:])
+    if int(digits[4]) != (1 if check in (0, 10, 11) else check):
+        return None
+    
+    factor, due_date = int(digits[5:9]), None
+    if factor:
+        today = date.today()
+        due_date = min((base + timedelta(days=factor) for base in BOLETO_FACTOR_BASES),
+                       key=lambda candidate: abs((candidate - today).days))
+    
+    return {
+        'kind': 'boleto',
+        'amount': Decimal(int(digits[9:19])).scaleb(-2) or None,
+        'date': due_date,
+        'description': f"Boleto {BOLETO_BANKS.get(digits[:3], 'banco ' + digits[:3])}",
+    }
+
+
+def parse_nfce(content):
+    """QR Code da NFC-e: emitente pela chave de acesso; dia e valor só na emissão offline"""
+    parameters = content.split('?', 1)[-1]
+    match = re.search(r'(?:^|&)p=([^&]+)', parameters)
+    parts = match.group(1).split('|') if match else []
+    if not parts or not re.fullmatch(r'\d{44}', parts[0]):
+        return None
+    
+    key = parts[0]
+    cnpj = f'{key[6:8]}.{key[8:11]}.{key[11:14]}/{key[14:18]}-{key[18:20]}'
+    issued = amount = None
+    # Offline: chave|versão|ambiente|dia da emissão|valor|digest|id do CSC|hash
+    if len(parts) >= 8:
+        issued = date(2000 + int(key[2:4]), int(key[4:6]), int(parts[3]))
+        amount = parse_money(parts[4])
+    
+    return {'kind': 'nfce', 'amount': amount, 'date': issued, 'description': f'NFC-e {cnpj}'}
+
+
+def parse_receipt_code(content):
+    """Interpreta o conteúdo de um código lido; None se não for um formato conhecido"""
+    content = content.strip()
+    digits = re.sub(r'[\s.\-]', '', content)
+    try:
+        if content.startswith('000201'):
+            return parse_pix(content)
+        if 'nfce' in content.lower():
+            return parse_nfce(content)
+        if digits.isdigit() and len(digits) in (44, 47, 48):
+            return parse_boleto(digits)
+    except ValueError:
+        pass
+    return None
+
+
+def apply_receipt_scan(scan, symbols, error=None):
+    """Grava na leitura o resultado da decodificação, preferindo os códigos que trazem valor"""
+    scan.decoded_at = datetime.utcnow()
+    scan.error = error
+    scan.content = symbols[0][1] if symbols else None
+    scan.kind = scan.amount = scan.date = scan.description = None
+    
+    if error:
+        scan.status = 'error'
+        return
+    
+    parsed = [(content, parse_receipt_code(content)) for _, content in symbols]
+    parsed = [(content, data) for content, data in parsed if data]
+    if not parsed:
+        scan.status = 'empty'
+        return
+    
+    scan.content, data = max(parsed, key=lambda item: item[1]['amount'] is not None)
+    scan.status = 'found'
+    scan.kind, scan.amount, scan.date = data['kind'], data['amount'], data['date']
+    scan.description = data['description'][:200]
+
+
+def stored_receipts(user_id):
+    """Imagens já anexadas às transações do usuário, calculando o hash das que ainda não têm"""
+    rows = db.session.query(Transaction.id, Transaction.attachment, Transaction.attachment_hash).filter(
+        Transaction.user_id == user_id,
+        Transaction.attachment_type == 'image'
+    ).all()
+    
+    files, hashed = [], []
+    for transaction_id, attachment, sha256 in rows:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], attachment)
+        if not sha256:
+            try:
+                with open(path, 'rb') as source:
+                    sha256 = hashlib.sha256(source.read()).hexdigest()
+            except OSError:
+                continue  # Anexo removido do disco
+            hashed.append({'id': transaction_id, 'attachment_hash': sha256})
+        files.append((sha256, attachment))
+    
+    if hashed:
+        db.session.execute(update(Transaction), hashed)
+    return files
+
+
+@job_handler('scan_receipts', 'Leitura de comprovantes')
+def scan_receipts_job(job, payload):
+    if payload.get('stored'):
+        files = stored_receipts(job.user_id)
+        pending = register_receipts((sha256 for sha256, _ in files), include_pending=True)
+        files = list({sha256: [sha256, path] for sha256, path in files if sha256 in pending}.values())
+        db.session.commit()
+    else:
+        files = payload['files']
+    
+    # Etapas do tamanho do pool: o progresso avança e a memória fica limitada
+    step = app.config['RECEIPT_DECODE_PROCESSES'] * 4
+    found = 0
+    for start in range(0, len(files), step):
+        chunk = dict(files[start:start + step])
+        scans = ReceiptScan.query.filter(
+            ReceiptScan.sha256.in_(chunk),
+            ReceiptScan.status.in_(('pending', 'error'))
+        ).all()
+        
+        results = decode_receipts([os.path.join(app.config['UPLOAD_FOLDER'], chunk[scan.sha256]) for scan in scans])
+        for scan, (symbols, error) in zip(scans, results):
+            apply_receipt_scan(scan, symbols, error)
+            found += scan.status == 'found'
+        job.report(start + len(chunk), len(files), f'{found} comprovante(s) com código reconhecido')
+    
+    return {'scanned': len(files), 'found': found}
+
+
+@app.route('/receipt/scan', methods=['POST'])
+@login_required
+def scan_receipt():
+    """Recebe o comprovante antes de salvar a transação e agenda sua leitura para pré-preencher o formulário"""
+    file = request.files.get('attachment')
+    if not file or not file.filename or attachment_kind(file.filename) != 'image':
+        return jsonify({'error': 'Envie uma imagem (JPG, PNG ou GIF).'}), 400
+    
+    data = file.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = staged_receipt(sha256)
+    if not path:
+        path = os.path.join(RECEIPT_STAGING_DIR, sha256 + os.path.splitext(file.filename)[1].lower())
+        with open(path, 'wb') as output:
+            output.write(data)
+    
+    job = scan_receipts([(sha256, os.path.relpath(path, app.config['UPLOAD_FOLDER']))], current_user.id)
+    scan = ReceiptScan.query.filter_by(sha256=sha256).first()
+    return jsonify(dict(scan.to_dict(), job_id=job.id if job else None))
+
+
+@app.route('/receipt/<sha256>')
+@login_required
+def receipt_status(sha256):
+    """Resultado da leitura de um comprovante (para acompanhamento via JavaScript)"""
+    scan = ReceiptScan.query.filter_by(sha256=sha256).first_or_404()
+    return jsonify(scan.to_dict())
+
+
+@app.route('/receipts/scan', methods=['POST'])
+@login_required
+def scan_stored_receipts():
+    """Lê os comprovantes já anexados às transações"""
+    enqueue_job('scan_receipts', current_user.id, {'stored': True})
+    
+    flash('Leitura dos comprovantes anexados iniciada! Acompanhe o andamento abaixo.', 'success')
+    return redirect(url_for('jobs'))
+
+
+@app.cli.command('scan-receipts')
+def scan_receipts_command():
+    """Agenda a leitura dos comprovantes anexados de todos os usuários e limpa os envios antigos"""
+    # Enviados para pré-preenchimento há mais de um dia: a transação já foi salva (com cópia própria) ou abandonada
+    limit = time.time() - 86400
+    removed = 0
+    for entry in os.scandir(RECEIPT_STAGING_DIR):
+        if entry.is_file() and entry.stat().st_mtime < limit:
+            os.remove(entry.path)
+            removed += 1
+    
+    users = User.query.all()
+    for user in users:
+        enqueue_job('scan_receipts', user.id, {'stored': True})
+    print(f'Leitura de comprovantes agendada para {len(users)} usuário(s); {removed} envio(s) antigo(s) removido(s).')
+
+
+# ==================== IMPORTAÇÃO ====================
+
+IMPORT_COLUMNS = {
+    'date': ('data', 'date', 'data lancamento'),
+    'description': ('descricao', 'description', 'historico', 'lancamento'),
+    'amount': ('valor', 'amount', 'valor (r$)'),
+}
+
+
+def parse_import_amount(value):
+    """Converte '1.234,56', '-12.50' ou 'R$ 10,00' para Decimal"""
+    value = value.replace('R$', '').replace(' ', '').strip()
+    if ',' in value:
+        value = value.replace('.', '').replace(',', '.')
+    return parse_money(value)
+
+
+def parse_import_date(value):
+    for date_format in ('%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y'):
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Data inválida: {value}')
+
+
+def read_import_csv(file):
+    """Lê um extrato CSV (data, descrição, valor) em linhas normalizadas"""
+    content = file.read().decode('utf-8-sig', errors='replace')
+    dialect = csv.Sniffer().sniff(content[:2048], delimiters=',;\t')
+    reader = csv.DictReader(io.StringIO(content), dialect=dialect)
+    
+    columns = {}
+    for field in reader.fieldnames or []:
+        for key, aliases in IMPORT_COLUMNS.items():
+            if normalize_text(field).strip() in aliases:
+                columns[key] = field
+    
+    if len(columns) < len(IMPORT_COLUMNS):
+        raise ValueError('O arquivo precisa das colunas data, descrição e valor')
+    
+    rows = []
+    for line in reader:
+        # Campos ausentes no fim da linha vêm como None
+        values = {key: (line.get(field) or '').strip() for key, field in columns.items()}
+        if not values['date']:
+            continue
+        if not values['amount']:
+            raise ValueError(f'Linha {reader.line_num} incompleta: falta o valor')
+        rows.append({
+            'date': parse_import_date(values['date']),
+            'description': values['description'],
+            'amount': parse_import_amount(values['amount']),
+        })
+    
+    return rows
+
+
+def import_transactions(user_id, rows, account_id=None, credit_card_id=None, duplicates='skip'):
+    """Importa um lote de transações; retorna (importadas, duplicadas)"""
+    now = datetime.utcnow()
+    
+    for row in rows:
+        amount = row.pop('amount')
+        row.update(
+            user_id=user_id,
+            account_id=account_id,
+            credit_card_id=credit_card_id,
+            amount=abs(amount),
+            # Conta: sinal define o tipo; cartão: valores positivos são compras
+            type=('income' if amount > 0 else 'expense') if account_id else ('expense' if amount > 0 else 'income'),
+            fingerprint=compute_fingerprint(account_id, credit_card_id, abs(amount), row['description']),
+            possible_duplicate=False,
+            created_at=now
+        )
+    
+    duplicated = find_duplicates(user_id, rows)
+    if duplicates == 'skip':
+        new_rows = [row for index, row in enumerate(rows) if index not in duplicated]
+    else:
+        new_rows = rows
+        for index in duplicated:
+            rows[index]['possible_duplicate'] = True
+    
+    categorize_rows(user_id, new_rows)
+    
+    if new_rows:
+        db.session.execute(insert(Transaction), new_rows)
+        record_spending(
+            (user_id, row['category_id'], row['date'], row['amount']) for row in new_rows if row['type'] == 'expense'
+        )
+        
+        if account_id:
+            delta = sum(row['amount'] if row['type'] == 'income' else -row['amount'] for row in new_rows)
+            Account.query.filter_by(id=account_id).update(
+                {'current_balance': Account.current_balance + delta}, synchronize_session=False
+            )
+        else:
+            dates = [row['date'] for row in new_rows]
+            invalidate_invoice_totals(credit_card_id, period=(min(dates), max(dates)))
+    
+    db.session.commit()
+    return len(new_rows), len(duplicated)
+
+
+@app.route('/transactions/import', methods=['GET', 'POST'])
+@login_required
+def import_statement():
+    if request.method == 'POST':
+        payment_method = request.form.get('payment_method')
+        account_id = credit_card_id = None
+        if payment_method == 'debit':
+            account_id = Account.query.filter_by(id=request.form.get('account_id', type=int), user_id=current_user.id).first_or_404().id
+        else:
+            credit_card_id = CreditCard.query.filter_by(id=request.form.get('credit_card_id', type=int), user_id=current_user.id).first_or_404().id
+        
+        file = request.files.get('statement')
+        if not file or not file.filename:
+            flash('Selecione um arquivo CSV!', 'error')
+            return redirect(url_for('import_statement'))
+        
+        try:
+            rows = read_import_csv(file)
+        except (ValueError, KeyError, csv.Error) as error:
+            flash(f'Não foi possível ler o arquivo: {error}', 'error')
+            return redirect(url_for('import_statement'))
+        
+        enqueue_job('import_statement', current_user.id, {
+            'rows': [dict(row, date=row['date'].isoformat(), amount=str(row['amount'])) for row in rows],
+            'account_id': account_id,
+            'credit_card_id': credit_card_id,
+            'duplicates': request.form.get('duplicates', 'skip')
+        })
+        
+        flash(f'Importação de {len(rows)} linha(s) iniciada! Acompanhe o andamento abaixo.', 'success')
+        return redirect(url_for('jobs'))
+    
+    accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
+    credit_cards = CreditCard.query.filter_by(user_id=current_user.id, active=True).all()
+    
+    return render_template('import_transactions.html',
+                         accounts=accounts,
+                         credit_cards=credit_cards)
+
+
+# ==================== PARCELAS ====================
+
+@app.route('/installments')
+@login_required
+def installments_list():
+    status_filter = request.args.get('status', 'pending')
+    
+    queries = [installment_rows_query().where(Installment.user_id == current_user.id)]
+    
+    if status_filter == 'pending':
+        queries[0] = queries[0].where(Installment.paid == False)
+    elif status_filter == 'paid':
+        queries[0] = queries[0].where(Installment.paid == True)
+    
+    # Planos quitados arquivados: só aparecem nas listagens que incluem parcelas pagas
+    if status_filter != 'pending' and reaches_archive(current_user):
+        queries.append(installment_rows_query(installment_archive).where(installment_archive.c.user_id == current_user.id))
+    
+    installments = execute_rows(queries, lambda c: (c.due_date.asc(),))
+    
+    return render_template('installments.html', installments=installments, status_filter=status_filter)
+
+
+@app.route('/installment/pay/<int:id>', methods=['POST'])
+@login_required
+def pay_installment(id):
+    installment = Installment.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    if installment.paid:
+        flash('Parcela já foi paga!', 'warning')
+        return redirect(url_for('installments_list'))
+    
+    installment.paid = True
+    installment.paid_date = datetime.today().date()
+    
+    # Atualizar saldo da conta (se for débito)
+    if installment.account_id:
+        account = Account.query.get(installment.account_id)
+        account.current_balance -= installment.amount
+    
+    db.session.commit()
+    flash('Parcela paga com sucesso!', 'success')
+    return redirect(url_for('installments_list'))
+
+
+@app.route('/installment/unpay/<int:id>', methods=['POST'])
+@login_required
+def unpay_installment(id):
+    installment = Installment.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    if not installment.paid:
         flash('Parcela não está paga!', 'warning')
         return redirect(url_for('installments_list'))
     
@@ -675,6 +2479,140 @@ def unpay_installment(id):
     return redirect(url_for('installments_list'))
 
 
+# ==================== OPERAÇÕES EM LOTE ====================
+
+def batch_ids():
+    """IDs enviados em lote: formulário (ids=1&ids=2) ou JSON ({"ids": [1, 2]})"""
+    if request.is_json:
+        values = (request.get_json(silent=True) or {}).get('ids', [])
+    else:
+        values = request.form.getlist('ids')
+    return [int(value) for value in values if str(value).isdigit()]
+
+
+def batch_response(message, endpoint, **values):
+    """Resposta das operações em lote: JSON para clientes de API, redirect para formulários"""
+    if request.is_json:
+        return jsonify({'message': message, **values})
+    flash(message, 'success')
+    return redirect(request.referrer or url_for(endpoint))
+
+
+def apply_balance_deltas(deltas):
+    """Aplica {account_id: delta} em um único UPDATE"""
+    deltas = {account_id: delta for account_id, delta in deltas.items() if account_id and delta}
+    if deltas:
+        Account.query.filter(Account.id.in_(deltas)).update({
+            'current_balance': Account.current_balance + case(
+                {account_id: to_cents(delta) for account_id, delta in deltas.items()},
+                value=Account.id
+            )
+        }, synchronize_session=False)
+
+
+def set_installments_paid(user_id, criteria, paid):
+    """Paga (ou estorna) em lote as parcelas que atendem aos critérios; retorna a quantidade"""
+    base = [Installment.user_id == user_id, Installment.paid == (not paid), *criteria]
+    
+    # Débito: um delta de saldo por conta
+    sign = -1 if paid else 1
+    apply_balance_deltas({
+        account_id: sign * total
+        for account_id, total in db.session.query(Installment.account_id, func.sum(Installment.amount))
+        .filter(*base, Installment.account_id.isnot(None)).group_by(Installment.account_id)
+    })
+    
+    count = Installment.query.filter(*base).update({
+        'paid': paid,
+        'paid_date': date.today() if paid else None
+    }, synchronize_session=False)
+    
+    db.session.commit()
+    return count
+
+
+@app.route('/installments/pay', methods=['POST'])
+@login_required
+def pay_installments():
+    count = set_installments_paid(current_user.id, [Installment.id.in_(batch_ids())], True)
+    return batch_response(f'{count} parcela(s) paga(s)!', 'installments_list', count=count)
+
+
+@app.route('/installments/unpay', methods=['POST'])
+@login_required
+def unpay_installments():
+    count = set_installments_paid(current_user.id, [Installment.id.in_(batch_ids())], False)
+    return batch_response(f'{count} pagamento(s) revertido(s)!', 'installments_list', count=count)
+
+
+@app.route('/credit-card/invoice/<int:id>/pay', methods=['POST'])
+@login_required
+def pay_invoice(id):
+    """Paga todas as parcelas pendentes de um ciclo de fatura"""
+    card = CreditCard.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    cycle = InvoiceCycle.query.filter_by(
+        credit_card_id=card.id, id=request.values.get('cycle_id', type=int)
+    ).first_or_404()
+    
+    count = set_installments_paid(current_user.id, [Installment.invoice_cycle_id == cycle.id], True)
+    return batch_response(f'Fatura paga: {count} parcela(s) baixada(s)!', 'credit_cards', count=count)
+
+
+@app.route('/transactions/batch', methods=['POST'])
+@login_required
+def batch_transactions():
+    """Recategoriza ou exclui um conjunto de transações"""
+    payload = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    action = payload.get('action')
+    base = [Transaction.user_id == current_user.id, Transaction.id.in_(batch_ids())]
+    
+    if action == 'recategorize':
+        category_id = payload.get('category_id') or None
+        if category_id:
+            category_id = Category.query.filter_by(id=int(category_id), user_id=current_user.id).first_or_404().id
+        
+        # Mover os gastos da categoria antiga para a nova nos contadores
+        moved = db.session.execute(spending_select(Transaction.__table__, *base)).all()
+        upsert_spending(moved, sign=-1)
+        upsert_spending((user_id, category_id, year, month, cents, total) for user_id, _, year, month, cents, total in moved)
+        
+        count = Transaction.query.filter(*base).update({'category_id': category_id}, synchronize_session=False)
+        db.session.commit()
+        return batch_response(f'{count} transação(ões) recategorizada(s)!', 'transactions', count=count)
+    
+    if action == 'delete':
+        # Estornar saldos (um delta por conta) e descongelar faturas afetadas
+        apply_balance_deltas({
+            account_id: total
+            for account_id, total in db.session.query(
+                Transaction.account_id,
+                func.sum(case((Transaction.type == 'income', -Transaction.amount), else_=Transaction.amount))
+            ).filter(*base, Transaction.account_id.isnot(None)).group_by(Transaction.account_id)
+        })
+        
+        for card_id, first_date, last_date in db.session.query(
+            Transaction.credit_card_id, func.min(Transaction.date), func.max(Transaction.date)
+        ).filter(*base, Transaction.credit_card_id.isnot(None)).group_by(Transaction.credit_card_id):
+            invalidate_invoice_totals(card_id, period=(first_date, last_date))
+        
+        upsert_spending(db.session.execute(spending_select(Transaction.__table__, *base)).all(), sign=-1)
+        
+        attachments = db.session.query(Transaction.attachment).filter(*base, Transaction.attachment.isnot(None)).all()
+        
+        count = Transaction.query.filter(*base).delete(synchronize_session=False)
+        db.session.commit()
+        
+        for (attachment,) in attachments:
+            try:
+                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], attachment))
+            except OSError:
+                pass
+        
+        return batch_response(f'{count} transação(ões) excluída(s)!', 'transactions', count=count)
+    
+    abort(400)
+
+
 # ==================== CONTAS ====================
 
 @app.route('/accounts')
@@ -688,7 +2626,7 @@ def accounts():
 @login_required
 def add_account():
     if request.method == 'POST':
-        initial_balance = float(request.form.get('initial_balance', 0))
+        initial_balance = parse_money(request.form.get('initial_balance'), Decimal(0))
         account = Account(
             user_id=current_user.id,
             name=request.form.get('name'),
@@ -727,6 +2665,110 @@ def edit_account(id):
     return render_template('edit_account.html', account=account)
 
 
+# Origem de cada linha do extrato (também desempata lançamentos do mesmo dia)
+LEDGER_TRANSACTION, LEDGER_INSTALLMENT, LEDGER_TRANSFER_IN, LEDGER_TRANSFER_OUT = range(4)
+
+
+def ledger_query(account, until=None):
+    """Subconsulta (date, kind, id, description, delta) com tudo que movimenta o saldo da conta.
+    
+    `delta` é o efeito no saldo em centavos. Com `until`, apenas lançamentos até essa data,
+    e o arquivo só entra se o período alcançá-lo.
+    """
+    cents = lambda column: type_coerce(column, db.Integer)
+    parts = []
+    
+    transaction_tables = [Transaction.__table__]
+    installment_tables = [Installment.__table__]
+    if db.session.get(User, account.user_id).archived_until:
+        transaction_tables.append(transaction_archive)
+        installment_tables.append(installment_archive)
+    
+    for t in transaction_tables:
+        parts.append(select(
+            t.c.date, literal(LEDGER_TRANSACTION).label('kind'), t.c.id, t.c.description,
+            case((t.c.type == 'income', cents(t.c.amount)), else_=-cents(t.c.amount)).label('delta')
+        ).where(t.c.account_id == account.id, *([t.c.date <= until] if until else [])))
+    
+    for i in installment_tables:
+        parts.append(select(
+            i.c.paid_date, literal(LEDGER_INSTALLMENT), i.c.id, i.c.description, -cents(i.c.amount)
+        ).where(i.c.account_id == account.id, i.c.paid == True, *([i.c.paid_date <= until] if until else [])))
+    
+    parts.append(select(
+        Transfer.date, literal(LEDGER_TRANSFER_IN), Transfer.id, Transfer.description, cents(Transfer.amount)
+    ).where(Transfer.to_account_id == account.id, *([Transfer.date <= until] if until else [])))
+    parts.append(select(
+        Transfer.date, literal(LEDGER_TRANSFER_OUT), Transfer.id, Transfer.description, -cents(Transfer.amount)
+    ).where(Transfer.from_account_id == account.id, *([Transfer.date <= until] if until else [])))
+    
+    return union_all(*parts).subquery('ledger')
+
+
+def account_balance_at(account, on_date):
+    """Saldo da conta ao fim de um dia: saldo inicial + soma indexada dos lançamentos até a data"""
+    ledger = ledger_query(account, until=on_date)
+    cents = db.session.execute(select(func.coalesce(func.sum(ledger.c.delta), 0))).scalar()
+    return account.initial_balance + Decimal(cents).scaleb(-2)
+
+
+@app.route('/account/<int:id>/statement')
+@login_required
+def account_statement(id):
+    """Extrato da conta em ordem cronológica, com saldo acumulado calculado no banco"""
+    account = Account.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    page_size = app.config['STATEMENT_PAGE_SIZE']
+    
+    ledger = ledger_query(account)
+    key = (ledger.c.date, ledger.c.kind, ledger.c.id)
+    
+    # Paginação por chave (?after=AAAA-MM-DD.tipo.id): a página seguinte começa depois da última linha exibida
+    after = request.args.get('after')
+    cursor = None
+    if after:
+        try:
+            day, kind, row_id = after.split('.')
+            cursor = (date.fromisoformat(day), int(kind), int(row_id))
+        except ValueError:
+            abort(404)
+    
+    # Saldo antes da página (uma soma) + soma acumulada dentro da página (janela)
+    opening = to_cents(account.initial_balance)
+    if cursor:
+        opening += db.session.execute(
+            select(func.coalesce(func.sum(ledger.c.delta), 0)).where(tuple_(*key) <= tuple_(*cursor))
+        ).scalar()
+    
+    page = select(ledger).order_by(*key).limit(page_size)
+    if cursor:
+        page = page.where(tuple_(*key) > tuple_(*cursor))
+    page = page.subquery('page')
+    
+    rows = db.session.execute(select(
+        page.c.date, page.c.kind, page.c.id, page.c.description,
+        type_coerce(page.c.delta, Money).label('amount'),
+        type_coerce(opening + func.sum(page.c.delta).over(order_by=(page.c.date, page.c.kind, page.c.id)), Money).label('balance')
+    ).order_by(page.c.date, page.c.kind, page.c.id)).yield_per(100)
+    
+    # Saldo em uma data específica (?on=AAAA-MM-DD)
+    balance_on = request.args.get('on')
+    balance_at = None
+    if balance_on:
+        try:
+            balance_on = date.fromisoformat(balance_on)
+        except ValueError:
+            abort(404)
+        balance_at = account_balance_at(account, balance_on)
+    
+    return stream_template('account_statement.html',
+                           account=account,
+                           rows=rows,
+                           page_size=page_size,
+                           after=after,
+                           balance_on=balance_on,
+                           balance_at=balance_at)
+
+
 # ==================== CARTÕES DE CRÉDITO ====================
 
 @app.route('/credit-cards')
@@ -737,9 +2779,8 @@ def credit_cards():
     # Calcular dados de cada cartão
     cards_data = []
     for card in cards:
-        start_date, end_date = card.get_current_invoice_period()
-        current_invoice = card.get_invoice_total(start_date, end_date)
-        available_limit = card.get_available_limit()
+        current_invoice = card.get_invoice_total(card.get_invoice_cycle())
+        available_limit = card.limit - current_invoice
         
         cards_data.append({
             'card': card,
@@ -748,6 +2789,8 @@ def credit_cards():
             'usage_percent': (current_invoice / card.limit * 100) if card.limit > 0 else 0
         })
     
+    db.session.commit()  # Ciclos gerados e totais congelados acima
+    
     return render_template('credit_cards.html', cards_data=cards_data)
 
 
@@ -758,7 +2801,7 @@ def add_credit_card():
         card = CreditCard(
             user_id=current_user.id,
             name=request.form.get('name'),
-            limit=float(request.form.get('limit')),
+            limit=parse_money(request.form.get('limit')),
             closing_day=int(request.form.get('closing_day')),
             due_day=int(request.form.get('due_day')),
             color=request.form.get('color', '#8B5CF6'),
@@ -768,6 +2811,10 @@ def add_credit_card():
         db.session.add(card)
         db.session.commit()
         
+        # Pré-gerar o calendário de faturas
+        card.get_invoice_cycle()
+        db.session.commit()
+        
         flash('Cartão de crédito adicionado com sucesso!', 'success')
         return redirect(url_for('credit_cards'))
     
@@ -780,15 +2827,24 @@ def edit_credit_card(id):
     card = CreditCard.query.filter_by(id=id, user_id=current_user.id).first_or_404()
     
     if request.method == 'POST':
+        old_days = (card.closing_day, card.due_day)
+        
         card.name = request.form.get('name')
-        card.limit = float(request.form.get('limit'))
+        card.limit = parse_money(request.form.get('limit'))
         card.closing_day = int(request.form.get('closing_day'))
         card.due_day = int(request.form.get('due_day'))
         card.color = request.form.get('color')
         card.icon = request.form.get('icon')
         card.active = request.form.get('active') == 'on'
         
+        # Recalcular calendário de faturas se os dias mudaram
+        if (card.closing_day, card.due_day) != old_days:
+            card.regenerate_invoice_cycles()
+        
         db.session.commit()
+        
+        if (card.closing_day, card.due_day) != old_days:
+            enqueue_job('rebuild_invoice_totals', current_user.id, {'credit_card_id': card.id})
         flash('Cartão atualizado com sucesso!', 'success')
         return redirect(url_for('credit_cards'))
     
@@ -800,30 +2856,64 @@ def edit_credit_card(id):
 def credit_card_invoice(id):
     card = CreditCard.query.filter_by(id=id, user_id=current_user.id).first_or_404()
     
-    # Período da fatura
-    start_date, end_date = card.get_current_invoice_period()
+    # Ciclo da fatura (?cycle=YYYY-MM; padrão: fatura atual)
+    reference = request.args.get('cycle')
+    if reference:
+        try:
+            year, month = map(int, reference.split('-'))
+            if not 1900 <= year <= 9998:
+                raise ValueError(reference)
+            cycle = card.get_invoice_cycle(clamp_day(year, month, card.closing_day) - timedelta(days=1))
+        except (ValueError, OverflowError):
+            abort(404)
+    else:
+        cycle = card.get_invoice_cycle()
+    
+    # Transações e parcelas da fatura (faturas antigas também leem o arquivo)
+    sources = [(Transaction.__table__, Installment.__table__)]
+    if reaches_archive(current_user, cycle.start_date):
+        sources.append((transaction_archive, installment_archive))
     
-    # Transações da fatura
-    transactions = Transaction.query.filter(
-        Transaction.credit_card_id == id,
-        Transaction.type == 'expense',
-        Transaction.date >= start_date,
-        Transaction.date < end_date
-    ).order_by(Transaction.date.desc()).all()
+    transactions = execute_rows([
+        transaction_rows_query(t).where(
+            t.c.credit_card_id == id,
+            t.c.type == 'expense',
+            t.c.date >= cycle.start_date,
+            t.c.date < cycle.end_date
+        ) for t, _ in sources
+    ], lambda c: (c.date.desc(),))
     
-    # Parcelas da fatura
-    installments = Installment.query.filter(
-        Installment.credit_card_id == id,
-        Installment.due_date >= start_date,
-        Installment.due_date < end_date
-    ).order_by(Installment.due_date.desc()).all()
+    installments = execute_rows([
+        installment_rows_query(i).where(i.c.invoice_cycle_id == cycle.id)
+        for _, i in sources
+    ], lambda c: (c.due_date.desc(),))
     
-    total = card.get_invoice_total(start_date, end_date)
+    # Total a partir das linhas já carregadas (ou do cache, se o ciclo estiver fechado)
+    if cycle.is_closed and cycle.total is not None:
+        total = cycle.total
+    else:
+        total = sum(t.amount for t in transactions) + sum(i.amount for i in installments)
+        cycle.store_total(total)
+    
+    # Histórico: 6 faturas anteriores e 6 seguintes
+    history = InvoiceCycle.query.filter(
+        InvoiceCycle.credit_card_id == id,
+        InvoiceCycle.year * 12 + InvoiceCycle.month >= cycle.year * 12 + cycle.month - 6,
+        InvoiceCycle.year * 12 + InvoiceCycle.month <= cycle.year * 12 + cycle.month + 6
+    ).order_by(InvoiceCycle.start_date).all()
+    history_totals = card.get_cycle_totals(history)
+    
+    db.session.commit()
     
     return render_template('credit_card_invoice.html',
                          card=card,
-                         start_date=start_date,
-                         end_date=end_date,
+                         cycle=cycle,
+                         start_date=cycle.start_date,
+                         end_date=cycle.end_date,
+                         previous_reference='%04d-%02d' % add_months(cycle.year, cycle.month, -1),
+                         next_reference='%04d-%02d' % add_months(cycle.year, cycle.month, 1),
+                         history=history,
+                         history_totals=history_totals,
                          transactions=transactions,
                          installments=installments,
                          total=total)
@@ -834,8 +2924,9 @@ def credit_card_invoice(id):
 @app.route('/transfers')
 @login_required
 def transfers_list():
-    transfers = Transfer.query.filter_by(user_id=current_user.id)\
-        .order_by(Transfer.date.desc()).all()
+    transfers = db.session.execute(
+        transfer_rows_query().where(Transfer.user_id == current_user.id).order_by(Transfer.date.desc())
+    ).all()
     return render_template('transfers.html', transfers=transfers)
 
 
@@ -850,7 +2941,7 @@ def add_transfer():
             flash('Não é possível transferir para a mesma conta!', 'error')
             return redirect(url_for('add_transfer'))
         
-        amount = float(request.form.get('amount'))
+        amount = parse_money(request.form.get('amount'))
         
         # Criar transferência
         transfer = Transfer(
@@ -948,48 +3039,657 @@ def edit_category(id):
     return render_template('edit_category.html', category=category)
 
 
-# ==================== RELATÓRIOS ====================
+# ==================== REGRAS DE CATEGORIZAÇÃO ====================
 
-@app.route('/reports')
-@login_required
-def reports():
-    today = datetime.today()
+def strip_accents(value):
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def normalize_text(value):
+    """Minúsculas e sem acentos, para comparar descrições"""
+    return strip_accents(value).lower()
+
+
+def rule_regex_group(rule_id, pattern):
+    """Trecho do matcher combinado para uma regra por expressão regular.
     
-    # Últimos 6 meses de dados
-    months_data = []
-    for i in range(5, -1, -1):
-        month_date = today - timedelta(days=30 * i)
-        month = month_date.month
-        year = month_date.year
-        
-        income = db.session.query(func.sum(Transaction.amount)).filter(
-            Transaction.user_id == current_user.id,
-            Transaction.type == 'income',
-            extract('month', Transaction.date) == month,
-            extract('year', Transaction.date) == year
-        ).scalar() or 0
+    Só os acentos saem do padrão: minúsculas trocariam \\D por \\d, \\S por \\s etc., e o matcher
+    já ignora maiúsculas. Referências a grupos são recusadas (re.error), porque a numeração muda
+    quando as regras são combinadas e nomes de grupo se repetiriam entre regras.
+    """
+    position = 0
+    while position < len(pattern):
+        if pattern[position] == '\\':
+            if pattern[position + 1:position + 2].isdigit() and pattern[position + 1] != '0':
+                raise re.error('referências numéricas a grupos não são suportadas', pattern, position)
+            position += 2
+            continue
+        if pattern.startswith(('(?P', '(?('), position):
+            raise re.error('grupos nomeados e condicionais não são suportados', pattern, position)
+        position += 1
+    
+    pattern = strip_accents(pattern)
+    re.compile(pattern)  # Sozinho também: parênteses desbalanceados como 'a)|(b' compilariam dentro do grupo
+    group = f'(?:(?=.*?(?P<r{rule_id}>{pattern})))?'
+    re.compile(group, re.IGNORECASE | re.DOTALL)
+    return group
+
+
+class RuleMatcher:
+    """Todas as regras ativas de um usuário compiladas em uma única expressão regular.
+    
+    Cada regra com texto vira um lookahead opcional com grupo nomeado, então uma
+    única chamada a `match()` por descrição informa todas as regras que casaram.
+    """
+    
+    def __init__(self, rules):
+        self.rules = []
+        groups = []
         
-        expense = db.session.query(func.sum(Transaction.amount)).filter(
-            Transaction.user_id == current_user.id,
-            Transaction.type == 'expense',
-            Transaction.account_id.isnot(None),
-            extract('month', Transaction.date) == month,
-            extract('year', Transaction.date) == year
-        ).scalar() or 0
+        for rule in sorted(rules, key=lambda r: (r.priority or 0, r.id)):
+            self.rules.append((
+                f'r{rule.id}' if rule.match_type != 'any' else None,
+                rule.category_id, rule.min_amount, rule.max_amount,
+                rule.account_id, rule.credit_card_id
+            ))
+            if rule.match_type == 'keyword':
+                groups.append(f'(?:(?=.*?(?P<r{rule.id}>{re.escape(normalize_text(rule.pattern))})))?')
+            elif rule.match_type == 'regex':
+                try:
+                    groups.append(rule_regex_group(rule.id, rule.pattern))
+                except re.error:
+                    pass  # Regra gravada antes da validação atual: nunca casa, mas não derruba as demais
         
-        # Parcelas pagas
-        installments_paid = db.session.query(func.sum(Installment.amount)).filter(
-            Installment.user_id == current_user.id,
-            Installment.paid == True,
-            extract('month', Installment.paid_date) == month,
-            extract('year', Installment.paid_date) == year,
-            Installment.account_id.isnot(None)
-        ).scalar() or 0
+        self.pattern = re.compile(''.join(groups), re.IGNORECASE | re.DOTALL)
+    
+    def match(self, description, amount=None, account_id=None, credit_card_id=None):
+        """Retorna a categoria da regra de maior prioridade que casa, ou None"""
+        hits = self.pattern.match(normalize_text(description)).groupdict()
+        
+        for group, category_id, min_amount, max_amount, rule_account_id, rule_card_id in self.rules:
+            if group is not None and hits.get(group) is None:
+                continue
+            if min_amount is not None and (amount is None or amount < min_amount):
+                continue
+            if max_amount is not None and (amount is None or amount > max_amount):
+                continue
+            if rule_account_id and rule_account_id != account_id:
+                continue
+            if rule_card_id and rule_card_id != credit_card_id:
+                continue
+            return category_id
+        
+        return None
+
+
+# Cache por processo: user_id -> (assinatura das regras, matcher compilado)
+_rule_matchers = {}
+
+
+def get_rule_matcher(user_id):
+    """Retorna o matcher do usuário, recompilando apenas quando as regras mudam"""
+    signature = tuple(db.session.query(
+        func.count(CategoryRule.id), func.max(CategoryRule.updated_at)
+    ).filter(CategoryRule.user_id == user_id).one())
+    
+    cached = _rule_matchers.get(user_id)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    rules = CategoryRule.query.filter_by(user_id=user_id, active=True).all()
+    matcher = RuleMatcher(rules)
+    _rule_matchers[user_id] = (signature, matcher)
+    return matcher
+
+
+def categorize_rows(user_id, rows):
+    """Preenche `category_id` de linhas (dicts) sem categoria, em uma única passada"""
+    matcher = get_rule_matcher(user_id)
+    
+    for row in rows:
+        if not row.get('category_id'):
+            row['category_id'] = matcher.match(
+                row.get('description'), row.get('amount'),
+                row.get('account_id'), row.get('credit_card_id')
+            )
+    
+    return rows
+
+
+def recategorize_history(user_id, overwrite=False):
+    """Reaplica as regras a todo o histórico de transações e parcelas do usuário"""
+    matcher = get_rule_matcher(user_id)
+    updated = 0
+    
+    # Parcelas são avaliadas pelo valor total da compra, como no cadastro (e gastam no mês do vencimento)
+    for model, amount_column, day_column, is_expense in (
+        (Transaction, Transaction.amount, Transaction.date, Transaction.type == 'expense'),
+        (Installment, Installment.total_amount, Installment.due_date, literal(True))
+    ):
+        query = db.session.query(
+            model.id, model.description, amount_column, model.account_id, model.credit_card_id, model.category_id,
+            day_column, model.amount, is_expense
+        ).filter(model.user_id == user_id)
+        if not overwrite:
+            query = query.filter(model.category_id.is_(None))
+        
+        changes, removed, added = [], [], []
+        for row_id, description, amount, account_id, credit_card_id, category_id, day, spent, expense in query:
+            new_category_id = matcher.match(description, amount, account_id, credit_card_id)
+            if new_category_id and new_category_id != category_id:
+                changes.append({'id': row_id, 'category_id': new_category_id})
+                if expense:
+                    removed.append((user_id, category_id, day, spent))
+                    added.append((user_id, new_category_id, day, spent))
+        
+        if changes:
+            db.session.execute(update(model), changes)
+            record_spending(removed, sign=-1)
+            record_spending(added)
+        updated += len(changes)
+    
+    db.session.commit()
+    return updated
+
+
+@app.route('/rules')
+@login_required
+def rules():
+    rules_list = CategoryRule.query.filter_by(user_id=current_user.id)\
+        .order_by(CategoryRule.priority, CategoryRule.id).all()
+    return render_template('rules.html', rules=rules_list)
+
+
+@app.route('/rule/add', methods=['GET', 'POST'])
+@login_required
+def add_rule():
+    if request.method == 'POST':
+        match_type = request.form.get('match_type', 'keyword')
+        pattern = (request.form.get('pattern') or '').strip()
+        
+        if match_type != 'any' and not pattern:
+            flash('Informe o texto ou expressão da regra!', 'error')
+            return redirect(url_for('add_rule'))
+        
+        if match_type == 'regex':
+            try:
+                rule_regex_group(0, pattern)
+            except re.error:
+                flash('Expressão regular inválida!', 'error')
+                return redirect(url_for('add_rule'))
+        
+        category = Category.query.filter_by(id=request.form.get('category_id', type=int), user_id=current_user.id).first_or_404()
+        
+        rule = CategoryRule(
+            user_id=current_user.id,
+            category_id=category.id,
+            match_type=match_type,
+            pattern=pattern or None,
+            min_amount=parse_money(request.form.get('min_amount')),
+            max_amount=parse_money(request.form.get('max_amount')),
+            account_id=request.form.get('account_id', type=int),
+            credit_card_id=request.form.get('credit_card_id', type=int),
+            priority=request.form.get('priority', 0, type=int)
+        )
+        
+        db.session.add(rule)
+        db.session.commit()
+        
+        flash('Regra adicionada com sucesso!', 'success')
+        return redirect(url_for('rules'))
+    
+    accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
+    credit_cards = CreditCard.query.filter_by(user_id=current_user.id, active=True).all()
+    categories = Category.query.filter_by(user_id=current_user.id).order_by(Category.type, Category.name).all()
+    
+    return render_template('add_rule.html',
+                         accounts=accounts,
+                         credit_cards=credit_cards,
+                         categories=categories)
+
+
+@app.route('/rule/delete/<int:id>', methods=['POST'])
+@login_required
+def delete_rule(id):
+    rule = CategoryRule.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    db.session.delete(rule)
+    db.session.commit()
+    
+    flash('Regra excluída com sucesso!', 'success')
+    return redirect(url_for('rules'))
+
+
+@app.route('/rules/apply', methods=['POST'])
+@login_required
+def apply_rules():
+    """Recategoriza o histórico com as regras atuais"""
+    enqueue_job('recategorize', current_user.id, {'overwrite': request.form.get('overwrite') == 'on'})
+    
+    flash('Recategorização do histórico iniciada! Acompanhe o andamento abaixo.', 'success')
+    return redirect(url_for('jobs'))
+
+
+# ==================== LANÇAMENTOS RECORRENTES ====================
+
+def materialize_recurring(user_id=None, until=None):
+    """Lança as ocorrências vencidas das recorrências (de um usuário ou de todos) até `until`.
+    
+    Inserção em lote, um ajuste de saldo por conta e uma invalidação de fatura por cartão.
+    Retorna a quantidade de transações lançadas.
+    """
+    until = until or date.today()
+    query = RecurringRule.query.filter(
+        RecurringRule.active == True,
+        RecurringRule.next_date.isnot(None),
+        RecurringRule.next_date <= until
+    )
+    if user_id:
+        query = query.filter(RecurringRule.user_id == user_id)
+    
+    rows, deltas, card_periods = [], {}, {}
+    now = datetime.utcnow()
+    
+    for rule in query.all():
+        dates = list(rule.occurrences(until))
+        next_date = rule.following(dates[-1]) if dates else rule.next_date
+        if rule.end_date and next_date > rule.end_date:
+            next_date = None
         
-        expense += installments_paid
+        # Avanço condicional: outro processo que já lançou estas ocorrências vence
+        claimed = db.session.execute(
+            update(RecurringRule).where(
+                RecurringRule.id == rule.id,
+                RecurringRule.next_date == rule.next_date
+            ).values(next_date=next_date)
+        ).rowcount
+        if not claimed or not dates:
+            continue
+        
+        rows += [{
+            'user_id': rule.user_id,
+            'account_id': rule.account_id,
+            'credit_card_id': rule.credit_card_id,
+            'category_id': rule.category_id,
+            'description': rule.description,
+            'amount': rule.amount,
+            'type': rule.type,
+            'date': day,
+            'notes': rule.notes,
+            'recurring_rule_id': rule.id,
+            'fingerprint': compute_fingerprint(rule.account_id, rule.credit_card_id, rule.amount, rule.description),
+            'possible_duplicate': False,
+            'created_at': now
+        } for day in dates]
+        
+        if rule.account_id:
+            sign = 1 if rule.type == 'income' else -1
+            deltas[rule.account_id] = deltas.get(rule.account_id, 0) + sign * rule.amount * len(dates)
+        elif rule.credit_card_id:
+            first, last = card_periods.get(rule.credit_card_id, (dates[0], dates[-1]))
+            card_periods[rule.credit_card_id] = (min(first, dates[0]), max(last, dates[-1]))
+    
+    if rows:
+        db.session.execute(insert(Transaction), rows)
+        record_spending((row['user_id'], row['category_id'], row['date'], row['amount']) for row in rows if row['type'] == 'expense')
+        apply_balance_deltas(deltas)
+        for credit_card_id, period in card_periods.items():
+            invalidate_invoice_totals(credit_card_id, period=period)
+    
+    db.session.commit()
+    return len(rows)
+
+
+def project_recurring(user_id, start, end):
+    """Ocorrências futuras (data, tipo, valor) entre `start` e `end`, calculadas das regras sem gravar nada"""
+    rules = RecurringRule.query.filter(
+        RecurringRule.user_id == user_id,
+        RecurringRule.active == True,
+        RecurringRule.next_date.isnot(None),
+        RecurringRule.next_date <= end
+    ).all()
+    
+    return sorted(
+        (day, rule.type, rule.amount)
+        for rule in rules
+        for day in rule.occurrences(end, start=start)
+    )
+
+
+@job_handler('materialize_recurring', 'Lançamento de recorrências')
+def materialize_recurring_job(job, payload):
+    created = materialize_recurring(job.user_id)
+    job.message = f'{created} transação(ões) lançada(s)'
+    return {'created': created}
+
+
+@app.route('/recurring')
+@login_required
+def recurring():
+    rules_list = RecurringRule.query.filter_by(user_id=current_user.id)\
+        .order_by(RecurringRule.active.desc(), RecurringRule.next_date).all()
+    return render_template('recurring.html', rules=rules_list)
+
+
+@app.route('/recurring/add', methods=['GET', 'POST'])
+@login_required
+def add_recurring():
+    if request.method == 'POST':
+        payment_method = request.form.get('payment_method')
+        account_id = credit_card_id = None
+        if payment_method == 'credit':
+            credit_card_id = CreditCard.query.filter_by(id=request.form.get('credit_card_id', type=int), user_id=current_user.id).first_or_404().id
+        else:
+            account_id = Account.query.filter_by(id=request.form.get('account_id', type=int), user_id=current_user.id).first_or_404().id
+        
+        start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d').date()
+        end_date = request.form.get('end_date')
+        
+        rule = RecurringRule(
+            user_id=current_user.id,
+            account_id=account_id,
+            credit_card_id=credit_card_id,
+            category_id=request.form.get('category_id') or None,
+            description=request.form.get('description'),
+            amount=parse_money(request.form.get('amount')),
+            type=request.form.get('type'),
+            interval_months=int(request.form.get('interval_months', 1)),
+            day_of_month=int(request.form.get('day_of_month') or start_date.day),
+            start_date=start_date,
+            end_date=datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None,
+            notes=request.form.get('notes')
+        )
+        rule.next_date = rule.first_occurrence()
+        db.session.add(rule)
+        db.session.commit()
+        
+        # Ocorrências passadas (início retroativo) são lançadas em segundo plano
+        if rule.next_date <= date.today():
+            enqueue_job('materialize_recurring', current_user.id)
+        
+        flash('Recorrência criada com sucesso!', 'success')
+        return redirect(url_for('recurring'))
+    
+    accounts = Account.query.filter_by(user_id=current_user.id, active=True).all()
+    credit_cards = CreditCard.query.filter_by(user_id=current_user.id, active=True).all()
+    categories = Category.query.filter_by(user_id=current_user.id).all()
+    return render_template('add_recurring.html', accounts=accounts, credit_cards=credit_cards, categories=categories)
+
+
+@app.route('/recurring/toggle/<int:id>', methods=['POST'])
+@login_required
+def toggle_recurring(id):
+    """Pausa ou retoma uma recorrência (ao retomar, ocorrências do período pausado não são lançadas)"""
+    rule = RecurringRule.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    rule.active = not rule.active
+    
+    if rule.active and rule.next_date:
+        while rule.next_date < date.today():
+            rule.next_date = rule.following(rule.next_date)
+        if rule.end_date and rule.next_date > rule.end_date:
+            rule.next_date = None
+    
+    db.session.commit()
+    flash('Recorrência retomada!' if rule.active else 'Recorrência pausada!', 'success')
+    return redirect(url_for('recurring'))
+
+
+@app.route('/recurring/delete/<int:id>', methods=['POST'])
+@login_required
+def delete_recurring(id):
+    rule = RecurringRule.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    # Transações já lançadas são mantidas
+    Transaction.query.filter_by(recurring_rule_id=rule.id).update({'recurring_rule_id': None}, synchronize_session=False)
+    db.session.delete(rule)
+    db.session.commit()
+    
+    flash('Recorrência excluída! As transações já lançadas foram mantidas.', 'success')
+    return redirect(url_for('recurring'))
+
+
+# ==================== ORÇAMENTOS ====================
+
+def upsert_spending(rows, sign=1):
+    """Soma linhas (usuário, categoria, ano, mês, centavos, quantidade) aos contadores de gastos.
+    
+    Um INSERT ... ON CONFLICT DO UPDATE na mesma transação que alterou os lançamentos; `sign=-1` estorna.
+    """
+    values = [{
+        'user_id': user_id, 'category_id': category_id, 'year': year, 'month': month,
+        'total': Decimal(sign * int(cents)).scaleb(-2), 'count': sign * count
+    } for user_id, category_id, year, month, cents, count in rows if category_id and (cents or count)]
+    
+    if values:
+        statement = sqlite_insert(SpendCounter)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'category_id', 'year', 'month'],
+            set_={
+                'total': SpendCounter.total + statement.excluded.total,
+                'count': SpendCounter.count + statement.excluded.count
+            }
+        ), values)
+
+
+def record_spending(entries, sign=1):
+    """Soma despesas em memória (usuário, categoria, data, valor) aos contadores, agrupadas por mês"""
+    totals = {}
+    for user_id, category_id, day, amount in entries:
+        if category_id:
+            key = (user_id, int(category_id), day.year, day.month)
+            cents, count = totals.get(key, (0, 0))
+            totals[key] = (cents + to_cents(amount), count + 1)
+    
+    upsert_spending([(*key, cents, count) for key, (cents, count) in totals.items()], sign)
+
+
+def spending_select(table, *criteria):
+    """Despesas de uma tabela de lançamentos agregadas no banco: (usuário, categoria, ano, mês, centavos, quantidade)"""
+    if 'due_date' in table.c:
+        day, expense = table.c.due_date, []  # Parcelas: sempre despesa, no mês do vencimento
+    else:
+        day, expense = table.c.date, [table.c.type == 'expense']
+    year, month = extract('year', day), extract('month', day)
+    
+    return select(
+        table.c.user_id, table.c.category_id, year, month,
+        func.sum(type_coerce(table.c.amount, db.Integer)), func.count()
+    ).where(table.c.category_id.isnot(None), *expense, *criteria).group_by(
+        table.c.user_id, table.c.category_id, year, month
+    )
+
+
+def rebuild_spend_counters(user_id=None):
+    """Recalcula os contadores de gastos a partir dos lançamentos ativos e arquivados"""
+    counters = SpendCounter.query
+    if user_id:
+        counters = counters.filter_by(user_id=user_id)
+    counters.delete(synchronize_session=False)
+    
+    for table in (Transaction.__table__, transaction_archive, Installment.__table__, installment_archive):
+        criteria = [table.c.user_id == user_id] if user_id else []
+        upsert_spending(db.session.execute(spending_select(table, *criteria)).all())
+    
+    db.session.commit()
+
+
+def budget_status(user_id, year, month):
+    """Orçamentos do usuário com o gasto do mês, em uma única leitura indexada dos contadores"""
+    rows = db.session.query(
+        Budget.id, Budget.category_id, Budget.amount, Budget.alert_threshold,
+        Category.name, Category.color, Category.icon,
+        type_coerce(func.coalesce(SpendCounter.total, 0), Money).label('spent')
+    ).join(Category, Category.id == Budget.category_id).outerjoin(SpendCounter, and_(
+        SpendCounter.user_id == Budget.user_id,
+        SpendCounter.category_id == Budget.category_id,
+        SpendCounter.year == year,
+        SpendCounter.month == month
+    )).filter(Budget.user_id == user_id).order_by(Category.name).all()
+    
+    budgets = []
+    for row in rows:
+        percentage = float(row.spent * 100 / row.amount) if row.amount else 0
+        if percentage >= 100:
+            status = 'exceeded'
+        elif percentage >= row.alert_threshold:
+            status = 'warning'
+        else:
+            status = 'ok'
+        budgets.append(SimpleNamespace(**row._asdict(), remaining=row.amount - row.spent, percentage=percentage, status=status))
+    
+    return budgets
+
+
+@app.route('/budgets')
+@login_required
+def budgets():
+    today = date.today()
+    year, month = today.year, today.month
+    
+    # Mês consultado (?month=YYYY-MM)
+    reference = request.args.get('month')
+    if reference:
+        try:
+            year, month = (int(part) for part in reference.split('-'))
+            date(year, month, 1)
+        except ValueError:
+            abort(404)
+    
+    budgets_list = budget_status(current_user.id, year, month)
+    
+    return render_template('budgets.html',
+                         budgets=budgets_list,
+                         reference=date(year, month, 1),
+                         previous_month='%04d-%02d' % add_months(year, month, -1),
+                         next_month='%04d-%02d' % add_months(year, month, 1),
+                         total_amount=sum(budget.amount for budget in budgets_list),
+                         total_spent=sum(budget.spent for budget in budgets_list))
+
+
+@app.route('/budget/add', methods=['GET', 'POST'])
+@login_required
+def add_budget():
+    """Define o limite mensal de uma categoria (substitui o anterior, se houver)"""
+    if request.method == 'POST':
+        category = Category.query.filter_by(
+            id=request.form.get('category_id', type=int), user_id=current_user.id, type='expense'
+        ).first_or_404()
+        
+        amount = parse_money(request.form.get('amount'))
+        if not amount or amount <= 0:
+            flash('Informe um limite maior que zero!', 'error')
+            return redirect(url_for('add_budget'))
+        
+        budget = Budget.query.filter_by(user_id=current_user.id, category_id=category.id).first()
+        if budget is None:
+            budget = Budget(user_id=current_user.id, category_id=category.id)
+            db.session.add(budget)
+        
+        budget.amount = amount
+        budget.alert_threshold = min(100, max(1, request.form.get('alert_threshold', 80, type=int)))
+        db.session.commit()
+        
+        flash(f'Orçamento de {category.name} salvo com sucesso!', 'success')
+        return redirect(url_for('budgets'))
+    
+    categories = Category.query.filter_by(user_id=current_user.id, type='expense').order_by(Category.name).all()
+    selected = Budget.query.filter_by(user_id=current_user.id, category_id=request.args.get('category_id', type=int)).first()
+    return render_template('add_budget.html', categories=categories, budget=selected)
+
+
+@app.route('/budget/delete/<int:id>', methods=['POST'])
+@login_required
+def delete_budget(id):
+    budget = Budget.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    db.session.delete(budget)
+    db.session.commit()
+    
+    flash('Orçamento excluído com sucesso!', 'success')
+    return redirect(url_for('budgets'))
+
+
+@app.cli.command('rebuild-spending')
+def rebuild_spending_command():
+    """Recalcula os contadores de gastos dos orçamentos a partir dos lançamentos"""
+    for _ in each_partition():
+        rebuild_spend_counters()
+    print('Contadores de gastos recalculados.')
+
+
+# ==================== RELATÓRIOS ====================
+
+@app.route('/reports')
+@login_required
+def reports():
+    today = datetime.today()
+    
+    # Últimos 6 meses de dados: uma consulta por tabela, agregação vetorizada em centavos (int64)
+    first_year, first_month = add_months(today.year, today.month, -5)
+    first_day = date(first_year, first_month, 1)
+    month_index = lambda column: (extract('year', column) * 12 + extract('month', column)) - (first_year * 12 + first_month)
+    
+    transaction_rows = db.session.query(
+        month_index(Transaction.date),
+        Transaction.type == 'income',
+        Transaction.account_id.isnot(None),
+        type_coerce(Transaction.amount, db.Integer)
+    ).filter(
+        Transaction.user_id == current_user.id,
+        Transaction.date >= first_day
+    ).all()
+    
+    # Parcelas pagas (débito)
+    installment_rows = db.session.query(
+        month_index(Installment.paid_date),
+        type_coerce(Installment.amount, db.Integer)
+    ).filter(
+        Installment.user_id == current_user.id,
+        Installment.paid == True,
+        Installment.paid_date >= first_day,
+        Installment.account_id.isnot(None)
+    ).all()
+    
+    income_cents = np.zeros(6, dtype=np.int64)
+    expense_cents = np.zeros(6, dtype=np.int64)
+    
+    if transaction_rows:
+        months, is_income, is_debit, cents = (np.array(column, dtype=np.int64) for column in zip(*transaction_rows))
+        in_range = months < 6
+        np.add.at(income_cents, months[in_range & (is_income == 1)], cents[in_range & (is_income == 1)])
+        expense_mask = in_range & (is_income == 0) & (is_debit == 1)
+        np.add.at(expense_cents, months[expense_mask], cents[expense_mask])
+    
+    if installment_rows:
+        months, cents = (np.array(column, dtype=np.int64) for column in zip(*installment_rows))
+        np.add.at(expense_cents, months[months < 6], cents[months < 6])
+    
+    # Meses arquivados: totais mensais prontos em vez de ler o arquivo
+    if reaches_archive(current_user, first_day):
+        for index, source, type, debit, cents in db.session.query(
+            ArchiveSummary.year * 12 + ArchiveSummary.month - (first_year * 12 + first_month),
+            ArchiveSummary.source, ArchiveSummary.type, ArchiveSummary.debit,
+            type_coerce(func.sum(ArchiveSummary.total), db.Integer)
+        ).filter(
+            ArchiveSummary.user_id == current_user.id,
+            ArchiveSummary.year * 12 + ArchiveSummary.month >= first_year * 12 + first_month
+        ).group_by(ArchiveSummary.year, ArchiveSummary.month, ArchiveSummary.source, ArchiveSummary.type, ArchiveSummary.debit):
+            if index >= 6:
+                continue
+            if source == 'transaction' and type == 'income':
+                income_cents[index] += cents
+            elif type == 'expense' and debit:
+                expense_cents[index] += cents
+    
+    months_data = []
+    for i in range(6):
+        year, month = add_months(first_year, first_month, i)
+        income = Decimal(int(income_cents[i])).scaleb(-2)
+        expense = Decimal(int(expense_cents[i])).scaleb(-2)
         
         months_data.append({
-            'month': month_date.strftime('%b/%Y'),
+            'month': date(year, month, 1).strftime('%b/%Y'),
             'income': income,
             'expense': expense,
             'balance': income - expense
@@ -1006,6 +3706,26 @@ def reports():
         extract('year', Transaction.date) == today.year
     ).group_by(Category.id).order_by(func.sum(Transaction.amount).desc()).all()
     
+    if reaches_archive(current_user, date(today.year, 1, 1)):
+        archived = db.session.query(
+            Category.name,
+            Category.color,
+            func.sum(ArchiveSummary.total).label('total')
+        ).join(ArchiveSummary, ArchiveSummary.category_id == Category.id).filter(
+            ArchiveSummary.user_id == current_user.id,
+            ArchiveSummary.source == 'transaction',
+            ArchiveSummary.type == 'expense',
+            ArchiveSummary.year == today.year
+        ).group_by(Category.id).all()
+        
+        merged = {(cat.name, cat.color): cat.total for cat in category_expenses}
+        for cat in archived:
+            merged[cat.name, cat.color] = merged.get((cat.name, cat.color), 0) + cat.total
+        category_expenses = sorted(
+            (SimpleNamespace(name=name, color=color, total=total) for (name, color), total in merged.items()),
+            key=lambda cat: cat.total, reverse=True
+        )
+    
     total_expense = sum(cat.total for cat in category_expenses)
     
     category_data = []
@@ -1018,7 +3738,16 @@ def reports():
             'percentage': percentage
         })
     
-    # Comprometimento futuro por mês
+    # Comprometimento futuro por mês (recorrências projetadas direto das regras)
+    future_recurring = {}
+    for day, type, amount in project_recurring(
+        current_user.id,
+        date(*add_months(today.year, today.month, 1), 1),
+        date(*add_months(today.year, today.month, 5), 1) - timedelta(days=1)
+    ):
+        if type == 'expense':
+            future_recurring[day.year, day.month] = future_recurring.get((day.year, day.month), 0) + amount
+    
     future_months = []
     for i in range(3):
         future_date = today + timedelta(days=30 * (i + 1))
@@ -1034,7 +3763,8 @@ def reports():
         
         future_months.append({
             'month': future_date.strftime('%b/%Y'),
-            'amount': commitment
+            'amount': commitment,
+            'recurring': future_recurring.get((year, month), 0)
         })
     
     return render_template('reports.html',
@@ -1043,8 +3773,280 @@ def reports():
                          future_months=future_months)
 
 
+# ==================== ARQUIVAMENTO ====================
+
+def add_archive_summaries(user_id, source, rows):
+    """Acumula linhas (ano, mês, tipo, categoria, débito, total, quantidade) nos resumos mensais,
+    todas em um único INSERT ... ON CONFLICT DO UPDATE
+    """
+    values = [{
+        'user_id': user_id, 'year': year, 'month': month, 'source': source, 'type': type,
+        'category_id': category_id, 'debit': bool(debit), 'total': total, 'count': count
+    } for year, month, type, category_id, debit, total, count in rows]
+    
+    if values:
+        statement = sqlite_insert(ArchiveSummary)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[
+                ArchiveSummary.user_id, ArchiveSummary.year, ArchiveSummary.month, ArchiveSummary.source,
+                ArchiveSummary.type, func.coalesce(ArchiveSummary.category_id, literal_column('0')), ArchiveSummary.debit
+            ],
+            set_={
+                'total': ArchiveSummary.total + statement.excluded.total,
+                'count': ArchiveSummary.count + statement.excluded.count
+            }
+        ), values)
+
+
+def archive_old_records(user_id, cutoff):
+    """Move para o arquivo as transações anteriores a `cutoff` e os planos de parcelas
+    quitados que terminaram antes dela, registrando os totais mensais. Retorna (transações, parcelas).
+    """
+    now = datetime.utcnow()
+    
+    # Congelar os totais das faturas afetadas antes de mover seus lançamentos
+    for card in CreditCard.query.filter_by(user_id=user_id).all():
+        card.get_cycle_totals(InvoiceCycle.query.filter(
+            InvoiceCycle.credit_card_id == card.id,
+            InvoiceCycle.closing_date <= date.today(),
+            InvoiceCycle.start_date < cutoff
+        ).all())
+    
+    # Transações
+    condition = and_(Transaction.user_id == user_id, Transaction.date < cutoff)
+    add_archive_summaries(user_id, 'transaction', db.session.query(
+        extract('year', Transaction.date), extract('month', Transaction.date),
+        Transaction.type, Transaction.category_id, Transaction.account_id.isnot(None),
+        func.sum(Transaction.amount), func.count()
+    ).filter(condition).group_by(
+        extract('year', Transaction.date), extract('month', Transaction.date),
+        Transaction.type, Transaction.category_id, Transaction.account_id.isnot(None)
+    ).all())
+    
+    columns = [column.name for column in Transaction.__table__.columns if column.name != 'id']
+    db.session.execute(insert(transaction_archive).from_select(
+        ['source_id', *columns, 'archived_at'],
+        select(Transaction.id, *[Transaction.__table__.c[name] for name in columns], literal(now, db.DateTime)).where(condition)
+    ))
+    transactions = Transaction.query.filter(condition).delete(synchronize_session=False)
+    
+    # Parcelas: apenas planos inteiramente pagos cuja última parcela venceu antes do corte
+    settled_plans = select(Installment.fingerprint, Installment.purchase_date).where(
+        Installment.user_id == user_id
+    ).group_by(Installment.fingerprint, Installment.purchase_date).having(
+        func.min(case((Installment.paid == True, 1), else_=0)) == 1,
+        func.max(Installment.due_date) < cutoff
+    )
+    condition = and_(
+        Installment.user_id == user_id,
+        tuple_(Installment.fingerprint, Installment.purchase_date).in_(settled_plans)
+    )
+    paid_on = func.coalesce(Installment.paid_date, Installment.due_date)
+    add_archive_summaries(user_id, 'installment', db.session.query(
+        extract('year', paid_on), extract('month', paid_on),
+        literal('expense'), Installment.category_id, Installment.account_id.isnot(None),
+        func.sum(Installment.amount), func.count()
+    ).filter(condition).group_by(
+        extract('year', paid_on), extract('month', paid_on),
+        Installment.category_id, Installment.account_id.isnot(None)
+    ).all())
+    
+    columns = [column.name for column in Installment.__table__.columns if column.name != 'id']
+    db.session.execute(insert(installment_archive).from_select(
+        ['source_id', *columns, 'archived_at'],
+        select(Installment.id, *[Installment.__table__.c[name] for name in columns], literal(now, db.DateTime)).where(condition)
+    ))
+    installments = Installment.query.filter(condition).delete(synchronize_session=False)
+    
+    user = db.session.get(User, user_id)
+    if transactions or installments or user.archived_until:
+        user.archived_until = max(cutoff, user.archived_until or cutoff)
+    
+    db.session.commit()
+    return transactions, installments
+
+
+@job_handler('archive', 'Arquivamento de lançamentos antigos')
+def archive_job(job, payload):
+    cutoff = date.fromisoformat(payload['cutoff'])
+    transactions, installments = archive_old_records(job.user_id, cutoff)
+    job.message = f'{transactions} transação(ões) e {installments} parcela(s) arquivada(s)'
+    return {'transactions': transactions, 'installments': installments}
+
+
+@app.cli.command('archive')
+@click.option('--months', type=int, default=None, help='Idade mínima em meses (padrão: ARCHIVE_AFTER_MONTHS)')
+def archive_command(months):
+    """Agenda o arquivamento dos lançamentos antigos de todos os usuários"""
+    today = date.today()
+    cutoff = date(*add_months(today.year, today.month, -(months or app.config['ARCHIVE_AFTER_MONTHS'])), 1)
+    
+    users = User.query.all()
+    for user in users:
+        enqueue_job('archive', user.id, {'cutoff': cutoff.isoformat()})
+    print(f'Arquivamento anterior a {cutoff.strftime("%d/%m/%Y")} agendado para {len(users)} usuário(s).')
+
+
 # ==================== FUNÇÕES AUXILIARES ====================
 
+# Listagens somente leitura: apenas as colunas exibidas, em linhas leves (Row),
+# sem passar pelo identity map nem carregar relacionamentos sob demanda
+
+# (`table` permite montar a mesma listagem sobre a tabela de arquivo)
+
+def transaction_rows_query(table=None):
+    table = Transaction.__table__ if table is None else table
+    t = table.c
+    return select(
+        t.id, t.date, t.description, t.notes,
+        t.amount, t.type, t.attachment, t.possible_duplicate,
+        t.account_id, t.credit_card_id, t.category_id, t.created_at,
+        literal(table is transaction_archive, db.Boolean).label('archived'),
+        Category.name.label('category_name'), Category.color.label('category_color'), Category.icon.label('category_icon'),
+        Account.name.label('account_name'), Account.color.label('account_color'), Account.icon.label('account_icon'),
+        CreditCard.name.label('card_name'), CreditCard.color.label('card_color')
+    ).outerjoin(Category, Category.id == t.category_id)\
+     .outerjoin(Account, Account.id == t.account_id)\
+     .outerjoin(CreditCard, CreditCard.id == t.credit_card_id)
+
+
+def installment_rows_query(table=None):
+    table = Installment.__table__ if table is None else table
+    t = table.c
+    return select(
+        t.id, t.due_date, t.description, t.amount,
+        t.current_installment, t.total_installments, t.paid, t.paid_date,
+        t.account_id, t.credit_card_id,
+        literal(table is installment_archive, db.Boolean).label('archived'),
+        Category.name.label('category_name'), Category.color.label('category_color'),
+        Account.name.label('account_name'), CreditCard.name.label('card_name')
+    ).outerjoin(Category, Category.id == t.category_id)\
+     .outerjoin(Account, Account.id == t.account_id)\
+     .outerjoin(CreditCard, CreditCard.id == t.credit_card_id)
+
+
+def execute_rows(queries, order_by, limit=None):
+    """Executa uma listagem sobre a tabela quente e, se incluída, a de arquivo (UNION ALL), em uma só ordenação"""
+    rows = (union_all(*queries) if len(queries) > 1 else queries[0]).subquery()
+    query = select(rows).order_by(*order_by(rows.c))
+    if limit:
+        query = query.limit(limit)
+    return db.session.execute(query).all()
+
+
+def reaches_archive(user, start=None):
+    """Indica se um período (a partir de `start`; None = sem limite) alcança lançamentos arquivados"""
+    return bool(user.archived_until) and (start is None or start < user.archived_until)
+
+
+def transfer_rows_query():
+    from_account = aliased(Account)
+    to_account = aliased(Account)
+    return select(
+        Transfer.id, Transfer.date, Transfer.amount, Transfer.description,
+        from_account.name.label('from_account_name'), to_account.name.label('to_account_name')
+    ).join(from_account, from_account.id == Transfer.from_account_id)\
+     .join(to_account, to_account.id == Transfer.to_account_id)
+
+
+def search_matches(user_id, search, kind):
+    """Subconsulta (id, rank) com os registros que casam com a busca, por prefixo"""
+    terms = re.findall(r'\w+', search)
+    match = ' '.join(f'"{term}"*' for term in terms) or '""'
+    
+    return text("""
+        SELECT rowid / 4 AS id, rank FROM search_index
+        WHERE search_index MATCH :match AND user_id = :user_id AND rowid % 4 = :kind
+    """).bindparams(match=match, user_id=user_id, kind=kind).columns(
+        id=db.Integer, rank=db.Float
+    ).subquery()
+
+
+def invalidate_invoice_totals(credit_card_id, dates=(), cycle_ids=(), period=None):
+    """Descongela o total dos ciclos afetados por uma escrita"""
+    conditions = [InvoiceCycle.id.in_(cycle_ids)] if cycle_ids else []
+    conditions += [and_(InvoiceCycle.start_date <= d, InvoiceCycle.end_date > d) for d in dates]
+    if period:
+        conditions.append(and_(InvoiceCycle.start_date <= period[1], InvoiceCycle.end_date > period[0]))
+    
+    if credit_card_id and conditions:
+        InvoiceCycle.query.filter(
+            InvoiceCycle.credit_card_id == credit_card_id,
+            or_(*conditions)
+        ).update({'total': None, 'total_computed_at': None}, synchronize_session='fetch')
+
+
+def installment_base_description(description):
+    """Remove o sufixo ' - Parcela i/n' da descrição de uma parcela"""
+    return re.sub(r' - Parcela \d+/\d+$', '', description or '')
+
+
+def compute_fingerprint(account_id, credit_card_id, amount, description):
+    """Impressão digital de um lançamento: origem, valor em centavos e descrição normalizada"""
+    source = f'a{account_id}' if account_id else f'c{credit_card_id}'
+    words = re.sub(r'[^a-z0-9]+', ' ', normalize_text(description)).split()
+    key = f'{source}|{to_cents(amount or 0)}|{" ".join(words)}'
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def find_duplicates(user_id, rows, window_days=None, model=None):
+    """Índices das linhas (dicts com fingerprint e date) que já existem em até ±N dias"""
+    model = model or Transaction
+    date_column = Installment.purchase_date if model is Installment else Transaction.date
+    if window_days is None:
+        window_days = app.config['DUPLICATE_WINDOW_DAYS']
+    if not rows:
+        return set()
+    
+    window = timedelta(days=window_days)
+    fingerprints = {row['fingerprint'] for row in rows}
+    dates = [row['date'] for row in rows]
+    
+    existing = {}
+    for fingerprint, existing_date in db.session.query(model.fingerprint, date_column).filter(
+        model.user_id == user_id,
+        model.fingerprint.in_(fingerprints),
+        date_column >= min(dates) - window,
+        date_column <= max(dates) + window
+    ).distinct():
+        existing.setdefault(fingerprint, []).append(existing_date)
+    
+    return {
+        index for index, row in enumerate(rows)
+        if any(abs((row['date'] - existing_date).days) <= window_days for existing_date in existing.get(row['fingerprint'], ()))
+    }
+
+
+def add_months(year, month, delta):
+    """Soma `delta` meses a um par (ano, mês)"""
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def clamp_day(year, month, day):
+    """Limita o dia ao último dia do mês (ex.: 31 em fevereiro -> 28/29)"""
+    return date(year, month, min(day, monthrange(year, month)[1]))
+
+
+def compute_invoice_cycle(closing_day, due_day, year, month):
+    """Calcula as datas do ciclo de fatura que fecha no mês de referência"""
+    prev_year, prev_month = add_months(year, month, -1)
+    closing_date = clamp_day(year, month, closing_day)
+    
+    # Vencimento após o fechamento: no mesmo mês ou no seguinte
+    if due_day > closing_day:
+        due_date = clamp_day(year, month, due_day)
+    else:
+        due_date = clamp_day(*add_months(year, month, 1), due_day)
+    
+    return {
+        'start_date': clamp_day(prev_year, prev_month, closing_day),
+        'end_date': closing_date,
+        'closing_date': closing_date,
+        'due_date': due_date,
+    }
+
+
 def create_default_categories(user_id):
     """Cria categorias padrão para novos usuários"""
     default_categories = [
@@ -1072,8 +4074,331 @@ def create_default_categories(user_id):
     db.session.commit()
 
 
+# ==================== BANCO DE DADOS ====================
+
+def table_columns(table):
+    """Retorna os nomes das colunas de uma tabela SQLite"""
+    return {row[1] for row in db.session.execute(text(f'PRAGMA table_info("{table}")'))}
+
+
+def migrate_invoice_cycles():
+    """Cria o calendário de faturas e associa as parcelas de crédito existentes"""
+    if 'invoice_cycle_id' not in table_columns('installment'):
+        db.session.execute(text('ALTER TABLE installment ADD COLUMN invoice_cycle_id INTEGER REFERENCES invoice_cycle (id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_installment_invoice_cycle_id ON installment (invoice_cycle_id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transaction_card_date ON "transaction" (credit_card_id, date)'))
+    
+    today = date.today()
+    cards = db.session.execute(text("""
+        SELECT c.id, c.closing_day, c.due_day, MIN(i.due_date), MAX(i.due_date)
+        FROM credit_card c LEFT JOIN installment i ON i.credit_card_id = c.id
+        GROUP BY c.id
+    """)).all()
+    
+    for card_id, closing_day, due_day, first_due, last_due in cards:
+        first = min(first_due or today.isoformat(), today.isoformat())
+        last = max(last_due or today.isoformat(), today.isoformat())
+        year, month = add_months(int(first[:4]), int(first[5:7]), -app.config['INVOICE_CYCLES_MONTHS_BACK'])
+        end_year, end_month = add_months(int(last[:4]), int(last[5:7]), app.config['INVOICE_CYCLES_MONTHS_AHEAD'])
+        
+        while (year, month) <= (end_year, end_month):
+            period = compute_invoice_cycle(closing_day, due_day, year, month)
+            db.session.execute(text("""
+                INSERT OR IGNORE INTO invoice_cycle (credit_card_id, year, month, start_date, end_date, closing_date, due_date)
+                VALUES (:card_id, :year, :month, :start_date, :end_date, :closing_date, :due_date)
+            """), dict(period, card_id=card_id, year=year, month=month))
+            year, month = add_months(year, month, 1)
+    
+    db.session.execute(text("""
+        UPDATE installment SET invoice_cycle_id = (
+            SELECT c.id FROM invoice_cycle c
+            WHERE c.credit_card_id = installment.credit_card_id
+              AND installment.due_date >= c.start_date AND installment.due_date < c.end_date
+        )
+        WHERE credit_card_id IS NOT NULL AND invoice_cycle_id IS NULL
+    """))
+    
+    # Vencimentos antigos (compra + 30 dias por parcela) passam a ser o vencimento do ciclo, como no
+    # recálculo após editar o cartão
+    db.session.execute(text("""
+        UPDATE installment SET due_date = (
+            SELECT due_date FROM invoice_cycle WHERE invoice_cycle.id = installment.invoice_cycle_id
+        )
+        WHERE credit_card_id IS NOT NULL AND invoice_cycle_id IS NOT NULL
+    """))
+
+
+def migrate_invoice_totals_cache():
+    """Adiciona o cache de totais por ciclo de fatura"""
+    columns = table_columns('invoice_cycle')
+    if 'total' not in columns:
+        db.session.execute(text('ALTER TABLE invoice_cycle ADD COLUMN total FLOAT'))
+    if 'total_computed_at' not in columns:
+        db.session.execute(text('ALTER TABLE invoice_cycle ADD COLUMN total_computed_at DATETIME'))
+
+
+def migrate_fingerprints():
+    """Adiciona e preenche a impressão digital usada na detecção de duplicatas"""
+    if 'fingerprint' not in table_columns('transaction'):
+        db.session.execute(text('ALTER TABLE "transaction" ADD COLUMN fingerprint VARCHAR(20)'))
+    if 'possible_duplicate' not in table_columns('transaction'):
+        db.session.execute(text('ALTER TABLE "transaction" ADD COLUMN possible_duplicate BOOLEAN DEFAULT 0'))
+    if 'fingerprint' not in table_columns('installment'):
+        db.session.execute(text('ALTER TABLE installment ADD COLUMN fingerprint VARCHAR(20)'))
+    
+    rows = db.session.execute(text('SELECT id, account_id, credit_card_id, amount, description FROM "transaction"')).all()
+    if rows:
+        db.session.execute(text('UPDATE "transaction" SET fingerprint = :fingerprint WHERE id = :id'), [
+            {'id': row_id, 'fingerprint': compute_fingerprint(account_id, card_id, amount, description)}
+            for row_id, account_id, card_id, amount, description in rows
+        ])
+    
+    rows = db.session.execute(text('SELECT id, account_id, credit_card_id, total_amount, description FROM installment')).all()
+    if rows:
+        db.session.execute(text('UPDATE installment SET fingerprint = :fingerprint WHERE id = :id'), [
+            {'id': row_id, 'fingerprint': compute_fingerprint(account_id, card_id, amount, installment_base_description(description))}
+            for row_id, account_id, card_id, amount, description in rows
+        ])
+    
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transaction_fingerprint ON "transaction" (user_id, fingerprint, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_installment_fingerprint ON installment (user_id, fingerprint, purchase_date)'))
+
+
+def rebuild_table(table, expressions):
+    """Recria uma tabela SQLite com o esquema atual do modelo, copiando os dados.
+    
+    `expressions` mapeia coluna -> expressão SQL usada na cópia (padrão: a própria coluna).
+    """
+    connection = db.session.connection()
+    existing = table_columns(table.name)
+    columns = [column.name for column in table.columns if column.name in existing]
+    
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    ddl = re.sub(r'^\s*CREATE TABLE ("?)%s\1' % re.escape(table.name), f'CREATE TABLE "{table.name}__new"', ddl)
+    connection.exec_driver_sql(ddl)
+    
+    connection.exec_driver_sql(f"""
+        INSERT INTO "{table.name}__new" ({', '.join(f'"{c}"' for c in columns)})
+        SELECT {', '.join(expressions.get(c, f'"{c}"') for c in columns)} FROM "{table.name}"
+    """)
+    connection.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}__new" RENAME TO "{table.name}"')
+    
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def migrate_money_to_cents():
+    """Converte valores monetários de FLOAT (reais) para INTEGER (centavos)"""
+    for model in (Account, CreditCard, InvoiceCycle, Transaction, Installment, Transfer, CategoryRule):
+        table = model.__table__
+        money_columns = [column.name for column in table.columns if isinstance(column.type, Money)]
+        column_types = {row[1]: row[2].upper() for row in db.session.execute(text(f'PRAGMA table_info("{table.name}")'))}
+        
+        if all(column_types.get(name, 'INTEGER') == 'INTEGER' for name in money_columns):
+            continue
+        
+        rebuild_table(table, {
+            name: f'CAST(ROUND("{name}" * 100) AS INTEGER)' for name in money_columns
+        })
+        
+        if model is Installment:
+            resplit_installment_plans()
+    
+    # Congelados em reais: recalcular sob demanda
+    db.session.execute(text('UPDATE invoice_cycle SET total = NULL, total_computed_at = NULL'))
+
+
+def resplit_installment_plans():
+    """Redivide as compras parceladas gravadas em reais com `split_amount`, para a soma das
+    parcelas fechar com o total (arredondar cada parcela sozinha deixava 15x 533,33 = 7999,95).
+    O saldo das contas acompanha a diferença das parcelas no débito já pagas.
+    """
+    plans = {}
+    for row in db.session.execute(text(
+        'SELECT id, user_id, account_id, credit_card_id, paid, description, total_amount, amount, total_installments, purchase_date '
+        'FROM installment ORDER BY current_installment, id'
+    )):
+        key = (row.user_id, row.account_id, row.credit_card_id, installment_base_description(row.description),
+               row.total_amount, row.total_installments, row.purchase_date)
+        plans.setdefault(key, []).append(row)
+    
+    updates, balance_changes = [], {}
+    for (_, _, _, _, total, count, _), parcels in plans.items():
+        if total is None or len(parcels) != count or sum(parcel.amount for parcel in parcels) == total:
+            continue
+        for parcel, amount in zip(parcels, split_amount(Decimal(total).scaleb(-2), count)):
+            cents = to_cents(amount)
+            if cents == parcel.amount:
+                continue
+            updates.append({'id': parcel.id, 'amount': cents})
+            if parcel.paid and parcel.account_id:
+                balance_changes[parcel.account_id] = balance_changes.get(parcel.account_id, 0) + parcel.amount - cents
+    
+    if updates:
+        db.session.execute(text('UPDATE installment SET amount = :amount WHERE id = :id'), updates)
+    for account_id, delta in balance_changes.items():
+        if delta:
+            db.session.execute(text('UPDATE account SET current_balance = current_balance + :delta WHERE id = :id'),
+                               {'id': account_id, 'delta': delta})
+
+
+def migrate_recurring_rules():
+    """Vincula transações às recorrências que as lançaram"""
+    if 'recurring_rule_id' not in table_columns('transaction'):
+        db.session.execute(text('ALTER TABLE "transaction" ADD COLUMN recurring_rule_id INTEGER REFERENCES recurring_rule (id)'))
+
+
+def migrate_archive():
+    """Marca até onde os lançamentos de cada usuário foram arquivados"""
+    if 'archived_until' not in table_columns('user'):
+        db.session.execute(text('ALTER TABLE user ADD COLUMN archived_until DATE'))
+
+
+def migrate_ledger_indexes():
+    """Índices usados no extrato e no saldo por data de cada conta"""
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transaction_account_date ON "transaction" (account_id, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_installment_account_paid ON installment (account_id, paid_date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transfer_from_date ON transfer (from_account_id, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transfer_to_date ON transfer (to_account_id, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_transaction_archive_account_date ON transaction_archive (account_id, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_installment_archive_account_paid ON installment_archive (account_id, paid_date)'))
+
+
+def migrate_spend_counters():
+    """Preenche os contadores de gastos dos orçamentos com o histórico existente"""
+    rebuild_spend_counters()
+
+
+def migrate_receipts():
+    """Hash dos anexos, usado como chave do cache de leitura dos comprovantes"""
+    for table in ('transaction', 'transaction_archive'):
+        if 'attachment_hash' not in table_columns(table):
+            db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN attachment_hash VARCHAR(64)'))
+
+
+def migrate_job_checkpoint():
+    """Ponto de retomada das tarefas separado do payload"""
+    if 'checkpoint' not in table_columns('job'):
+        db.session.execute(text('ALTER TABLE job ADD COLUMN checkpoint TEXT'))
+
+
+def migrate_archive_summary_unique():
+    """Índice único dos resumos do arquivo, alvo do UPSERT no arquivamento"""
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_archive_summary_group ON archive_summary '
+        '(user_id, year, month, source, type, coalesce(category_id, 0), debit)'
+    ))
+
+
+# Migrações aplicadas em ordem; a versão do esquema fica em PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    migrate_invoice_cycles,
+    migrate_invoice_totals_cache,
+    migrate_fingerprints,
+    migrate_money_to_cents,
+    migrate_recurring_rules,
+    migrate_archive,
+    migrate_ledger_indexes,
+    migrate_spend_counters,
+    migrate_receipts,
+    migrate_job_checkpoint,
+    migrate_archive_summary_unique,
+]
+
+
+# Índice de busca textual: rowid = id * 4 + tipo do registro
+SEARCH_KIND_TRANSACTION = 0
+SEARCH_KIND_INSTALLMENT = 1
+SEARCH_KIND_TRANSACTION_ARCHIVE = 2
+SEARCH_KIND_INSTALLMENT_ARCHIVE = 3
+
+SEARCH_TRIGGERS = {
+    '"transaction"': SEARCH_KIND_TRANSACTION,
+    'installment': SEARCH_KIND_INSTALLMENT,
+    'transaction_archive': SEARCH_KIND_TRANSACTION_ARCHIVE,
+    'installment_archive': SEARCH_KIND_INSTALLMENT_ARCHIVE,
+}
+
+
+def create_search_index(connection):
+    """Cria o índice FTS5 de descrições/observações e os gatilhos que o mantêm sincronizado"""
+    exists = inspect(connection).has_table('search_index')
+    
+    connection.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            description, notes, user_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """))
+    
+    for table, kind in SEARCH_TRIGGERS.items():
+        name = table.strip('"')
+        connection.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_search_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO search_index (rowid, description, notes, user_id)
+                VALUES (new.id * 4 + {kind}, new.description, new.notes, new.user_id);
+            END
+        """))
+        connection.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_search_update AFTER UPDATE OF description, notes ON {table} BEGIN
+                UPDATE search_index SET description = new.description, notes = new.notes
+                WHERE rowid = old.id * 4 + {kind};
+            END
+        """))
+        connection.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_search_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = old.id * 4 + {kind};
+            END
+        """))
+        
+        # Índice recém-criado: carregar os registros existentes
+        if not exists:
+            connection.execute(text(f"""
+                INSERT INTO search_index (rowid, description, notes, user_id)
+                SELECT id * 4 + {kind}, description, notes, user_id FROM {table}
+            """))
+
+
+def migrate_schema():
+    """Cria as tabelas e aplica as migrações pendentes no banco em uso pela sessão"""
+    connection = db.session.connection()
+    fresh = not inspect(connection).has_table('user')
+    db.metadata.create_all(connection)
+    
+    version = db.session.execute(text('PRAGMA user_version')).scalar()
+    if fresh:
+        version = len(SCHEMA_MIGRATIONS)
+    
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        migration()
+        db.session.execute(text(f'PRAGMA user_version = {number}'))
+        db.session.commit()
+    
+    db.session.execute(text(f'PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}'))
+    create_search_index(db.session.connection())
+    db.session.commit()
+
+
+def init_db():
+    """Cria/atualiza o esquema do banco compartilhado e de cada partição existente"""
+    with use_partition(None):
+        migrate_schema()
+    
+    if partitioned():
+        for _ in each_partition():
+            migrate_schema()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria/atualiza o esquema do banco de dados"""
+    init_db()
+    print('Banco de dados atualizado.')
+
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
     #app.run(debug=True)
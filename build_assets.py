@@ -0,0 +1,170 @@
+"""Gera os arquivos estáticos versionados servidos pela aplicação.
+
+    python build_assets.py            # baixa o que faltar em static/vendor e gera static/dist
+    python build_assets.py --offline  # usa apenas o que já está em static/vendor
+
+As dependências de front-end (Chart.js, Font Awesome e o compilador do Tailwind) ficam
+fixadas em versões abaixo e são baixadas uma única vez para `static/vendor`. A geração:
+
+1. compila o CSS do Tailwind a partir dos templates (`tailwind.config.js`), sem JIT no navegador;
+2. copia cada arquivo para `static/dist` com o hash do conteúdo no nome;
+3. cria as variantes pré-comprimidas `.gz` (e `.br`, se o pacote `brotli` estiver instalado);
+4. grava `static/dist/manifest.json` (nome lógico -> nome com hash), lido pelo `asset_url()` da aplicação.
+
+Sem o manifesto, a aplicação continua carregando os arquivos das CDNs.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # Está em requirements.txt; sem ele, apenas as variantes gzip são geradas
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+
+TAILWIND_VERSION = '3.4.17'
+CHART_JS_VERSION = '4.4.7'
+FONT_AWESOME_VERSION = '6.4.0'
+
+FONT_AWESOME_URL = f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/{FONT_AWESOME_VERSION}'
+FONT_AWESOME_FONTS = [
+    f'{name}.{extension}'
+    for name in ('fa-solid-900', 'fa-regular-400', 'fa-brands-400', 'fa-v4compatibility')
+    for extension in ('woff2', 'ttf')
+]
+
+# Arquivo em static/vendor -> URL de origem
+VENDOR_FILES = {
+    'chart.umd.min.js': f'https://cdn.jsdelivr.net/npm/chart.js@{CHART_JS_VERSION}/dist/chart.umd.min.js',
+    'fontawesome/css/all.min.css': f'{FONT_AWESOME_URL}/css/all.min.css',
+    **{f'fontawesome/webfonts/{font}': f'{FONT_AWESOME_URL}/webfonts/{font}' for font in FONT_AWESOME_FONTS},
+}
+
+# Extensões que vale a pena pré-comprimir (woff2 já é comprimido)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ttf', '.json'}
+
+
+def tailwind_binary():
+    """Caminho e URL do executável standalone do Tailwind para esta plataforma"""
+    system = {'Linux': 'linux', 'Darwin': 'macos', 'Windows': 'windows'}[platform.system()]
+    machine = 'arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'x64'
+    name = f'tailwindcss-{system}-{machine}' + ('.exe' if system == 'windows' else '')
+    url = f'https://github.com/tailwindlabs/tailwindcss/releases/download/v{TAILWIND_VERSION}/{name}'
+    return os.path.join(VENDOR_DIR, 'bin', f'tailwindcss-{TAILWIND_VERSION}'), url
+
+
+def download(url, path):
+    print(f'  baixando {url}')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=60) as response, open(path + '.part', 'wb') as output:
+        shutil.copyfileobj(response, output)
+    os.replace(path + '.part', path)
+
+
+def fetch(offline):
+    """Garante que todas as dependências fixadas estejam em static/vendor"""
+    binary, binary_url = tailwind_binary()
+    missing = [(url, os.path.join(VENDOR_DIR, name)) for name, url in VENDOR_FILES.items()
+               if not os.path.exists(os.path.join(VENDOR_DIR, name))]
+    if not os.path.exists(binary):
+        missing.append((binary_url, binary))
+
+    if missing and offline:
+        sys.exit('Arquivos ausentes em static/vendor (rode sem --offline para baixá-los):\n'
+                 + '\n'.join(f'  {path}' for _, path in missing))
+
+    for url, path in missing:
+        download(url, path)
+
+    os.chmod(binary, os.stat(binary).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return binary
+
+
+def compile_tailwind(binary):
+    """CSS do Tailwind apenas com as classes usadas nos templates, minificado"""
+    output = os.path.join(VENDOR_DIR, 'build', 'app.css')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    subprocess.run([
+        binary,
+        '--config', os.path.join(BASE_DIR, 'tailwind.config.js'),
+        '--input', os.path.join(STATIC_DIR, 'src', 'app.css'),
+        '--output', output,
+        '--minify',
+    ], cwd=BASE_DIR, check=True)
+    return output
+
+
+def write_hashed(name, data):
+    """Grava `data` em static/dist com o hash no nome, mais as variantes comprimidas"""
+    stem, extension = os.path.splitext(name)
+    hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+    path = os.path.join(DIST_DIR, hashed)
+
+    with open(path, 'wb') as output:
+        output.write(data)
+
+    if extension in COMPRESSIBLE:
+        # mtime=0: a mesma entrada gera sempre o mesmo .gz
+        with open(path + '.gz', 'wb') as output:
+            output.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            with open(path + '.br', 'wb') as output:
+                output.write(brotli.compress(data, quality=11))
+
+    return hashed
+
+
+def build(offline):
+    binary = fetch(offline)
+    tailwind_css = compile_tailwind(binary)
+
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+    manifest = {}
+
+    # Fontes primeiro: o CSS do Font Awesome passa a apontar para os nomes com hash
+    fonts = {}
+    for font in FONT_AWESOME_FONTS:
+        with open(os.path.join(VENDOR_DIR, 'fontawesome', 'webfonts', font), 'rb') as source:
+            fonts[font] = manifest[f'webfonts/{font}'] = write_hashed(font, source.read())
+
+    with open(os.path.join(VENDOR_DIR, 'fontawesome', 'css', 'all.min.css'), encoding='utf-8') as source:
+        css = re.sub(
+            r'url\(\.\./webfonts/([^)?#]+)[^)]*\)',
+            lambda match: f'url({fonts[match.group(1)]})' if match.group(1) in fonts else match.group(0),
+            source.read()
+        )
+    manifest['fontawesome.css'] = write_hashed('fontawesome.css', css.encode('utf-8'))
+
+    with open(tailwind_css, 'rb') as source:
+        manifest['app.css'] = write_hashed('app.css', source.read())
+
+    with open(os.path.join(VENDOR_DIR, 'chart.umd.min.js'), 'rb') as source:
+        manifest['chart.js'] = write_hashed('chart.js', source.read())
+
+    with open(os.path.join(DIST_DIR, 'manifest.json'), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+
+    print(f'{len(manifest)} arquivo(s) gerado(s) em static/dist'
+          + ('' if brotli else ' (instale "brotli" para gerar também as variantes .br)'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera os arquivos estáticos versionados e pré-comprimidos')
+    parser.add_argument('--offline', action='store_true', help='Não baixa nada; falha se faltar algo em static/vendor')
+    build(parser.parse_args().offline)
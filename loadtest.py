@@ -0,0 +1,613 @@
+"""Teste de carga de ponta a ponta da aplicação sob o Gunicorn.
+
+Semeia um banco SQLite, sobe a aplicação com cada configuração de workers pedida
+(sync, gthread, gevent; quantidade de workers e threads; --preload) e reproduz uma
+mistura de tráfego autenticado (login, dashboard, transações, novo lançamento,
+pagamento de parcela e relatórios) em cada nível de concorrência. Para cada rodada
+informa vazão, percentis de latência, taxa de erros, erros de banco travado
+("database is locked"), a vazão de logins e o tempo de CPU de cada login (pela política de
+hash de senha da rodada) e a memória residente (RSS) de cada worker.
+
+Com --partition-mode user/bucket, o banco semeado é dividido em partições (flask split-db)
+antes das rodadas, para comparar o banco compartilhado com o particionado.
+
+Exemplo:
+    python loadtest.py --worker-class sync gthread --workers 2 4 --concurrency 4 16 --duration 20
+    python loadtest.py --worker-class gthread --workers 4 --partition-mode off user bucket
+    python loadtest.py --worker-class sync --workers 4 --password-hash-method scrypt:32768:8:1 pbkdf2:sha256:100000
+
+Cada rodada parte de uma cópia do banco semeado, então os resultados são comparáveis.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'loadtest'
+LOCK_ERROR = re.compile(r'^sqlalchemy\.exc\.OperationalError: .*database is locked', re.MULTILINE)
+
+# Mistura de tráfego: (ação, peso)
+TRAFFIC_MIX = [
+    ('dashboard', 30),
+    ('transactions', 25),
+    ('add_transaction', 15),
+    ('pay_installment', 10),
+    ('reports', 10),
+    ('login', 10),
+]
+
+
+# ==================== BANCO SEMEADO ====================
+
+def seed_database(path, users, transactions, installments):
+    """Cria o banco de teste com `users` usuários, cada um com histórico de 12 meses.
+
+    Retorna {username: [ids de parcelas pendentes]} para as ações de pagamento.
+    """
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['PARTITION_MODE'] = 'off'  # Semeia tudo no banco compartilhado; a divisão vem depois
+    sys.path.insert(0, BASE_DIR)
+    import app as finance
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    db = finance.db
+    rng = random.Random(42)
+    today = date.today()
+    pending = {}
+
+    with finance.app.app_context():
+        finance.init_db()
+        # Um hash só: o custo está no login, não na semeadura. Com outra política na rodada, o 1º login de cada usuário refaz o hash
+        password_hash = generate_password_hash(PASSWORD, finance.app.config['PASSWORD_HASH_METHOD'])
+
+        for n in range(users):
+            user = finance.User(username=f'load{n}', email=f'load{n}@example.com', password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            finance.create_default_categories(user.id)
+
+            categories = finance.Category.query.filter_by(user_id=user.id).all()
+            expense_ids = [category.id for category in categories if category.type == 'expense']
+            income_ids = [category.id for category in categories if category.type == 'income']
+
+            account = finance.Account(user_id=user.id, name='Conta Corrente', type='checking',
+                                      initial_balance=Decimal('5000'), current_balance=Decimal('5000'))
+            card = finance.CreditCard(user_id=user.id, name='Cartão', limit=Decimal('10000'), closing_day=10, due_day=20)
+            db.session.add_all([account, card])
+            db.session.commit()
+            card.get_invoice_cycle()
+
+            # Transações dos últimos 12 meses (1/4 no cartão, 1/5 receitas)
+            rows, balance = [], Decimal('5000')
+            now = datetime.utcnow()
+            for i in range(transactions):
+                income = i % 5 == 0
+                on_card = not income and i % 4 == 0
+                amount = Decimal(rng.randint(500, 50000)).scaleb(-2)
+                description = f'Lançamento {i}'
+                rows.append({
+                    'user_id': user.id,
+                    'account_id': None if on_card else account.id,
+                    'credit_card_id': card.id if on_card else None,
+                    'category_id': rng.choice(income_ids if income else expense_ids),
+                    'description': description,
+                    'amount': amount,
+                    'type': 'income' if income else 'expense',
+                    'date': today - timedelta(days=rng.randint(0, 365)),
+                    'fingerprint': finance.compute_fingerprint(
+                        None if on_card else account.id, card.id if on_card else None, amount, description
+                    ),
+                    'possible_duplicate': False,
+                    'created_at': now
+                })
+                if not on_card:
+                    balance += amount if income else -amount
+            if rows:
+                db.session.execute(insert(finance.Transaction), rows)
+
+            # Compras parceladas no débito em 6x, a primeira paga
+            rows = []
+            for i in range(installments):
+                total = Decimal(rng.randint(6000, 300000)).scaleb(-2)
+                purchase_date = today - timedelta(days=rng.randint(0, 60))
+                description = f'Compra parcelada {i}'
+                for number, amount in enumerate(finance.split_amount(total, 6), start=1):
+                    rows.append({
+                        'user_id': user.id,
+                        'account_id': account.id,
+                        'category_id': rng.choice(expense_ids),
+                        'description': f'{description} - Parcela {number}/6',
+                        'total_amount': total,
+                        'amount': amount,
+                        'current_installment': number,
+                        'total_installments': 6,
+                        'due_date': purchase_date + timedelta(days=30 * (number - 1)),
+                        'paid': number == 1,
+                        'paid_date': purchase_date if number == 1 else None,
+                        'purchase_date': purchase_date,
+                        'fingerprint': finance.compute_fingerprint(account.id, None, total, description),
+                        'created_at': now
+                    })
+                    if number == 1:
+                        balance -= amount
+            if rows:
+                db.session.execute(insert(finance.Installment), rows)
+
+            account.current_balance = balance
+            db.session.commit()
+
+            pending[user.username] = [
+                installment.id for installment in
+                finance.Installment.query.filter_by(user_id=user.id, paid=False).with_entities(finance.Installment.id)
+            ]
+
+        finance.rebuild_spend_counters()
+
+    return pending
+
+
+def partition_env(database, partition_mode, partition_dir):
+    """Variáveis de ambiente que apontam a aplicação para o banco (e as partições) da rodada"""
+    return {
+        'DATABASE_URL': f'sqlite:///{database}',
+        'PARTITION_MODE': partition_mode,
+        'PARTITION_DIR': partition_dir,
+    }
+
+
+def split_seed(seeded, partition_mode, workdir):
+    """Copia o banco semeado e o divide em partições; devolve (banco, diretório das partições)"""
+    database = os.path.join(workdir, f'seed_{partition_mode}.db')
+    partition_dir = os.path.join(workdir, f'seed_{partition_mode}_partitions')
+    shutil.copy(seeded, database)
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'split-db', '--purge'],
+        cwd=BASE_DIR, check=True, env=dict(os.environ, **partition_env(database, partition_mode, partition_dir))
+    )
+    return database, partition_dir
+
+
+def login_cpu_ms(method, rounds=5):
+    """Tempo de CPU (ms) de uma verificação de senha com a política `method`"""
+    from werkzeug.security import generate_password_hash, check_password_hash
+
+    password_hash = generate_password_hash(PASSWORD, method)
+    started = time.process_time()
+    for _ in range(rounds):
+        check_password_hash(password_hash, PASSWORD)
+    return (time.process_time() - started) / rounds * 1000
+
+
+# ==================== GUNICORN ====================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(config, database, partition_dir, port, log_path):
+    """Sobe o Gunicorn com a configuração pedida e espera ele aceitar conexões"""
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{port}',
+        '--worker-class', config['worker_class'],
+        '--workers', str(config['workers']),
+        '--timeout', '120',
+    ]
+    if config['worker_class'] == 'gthread':
+        command += ['--threads', str(config['threads'])]
+    elif config['worker_class'] == 'gevent':
+        command += ['--worker-connections', str(config['connections'])]
+    if config['preload']:
+        command.append('--preload')
+
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        command, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+        env=dict(os.environ, PASSWORD_HASH_METHOD=config['password_hash_method'],
+                 **partition_env(database, config['partition_mode'], partition_dir))
+    )
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Gunicorn encerrou ao iniciar (veja {log_path})')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            connection.close()
+            return process, log
+        except OSError:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError(f'Gunicorn não respondeu em 30s (veja {log_path})')
+
+
+def stop_server(process, log):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    log.close()
+
+
+def worker_pids(master_pid):
+    """PIDs dos workers (filhos diretos do processo mestre)"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    # O nome do processo pode conter espaços: os campos seguem o último ')'
+                    if int(stat.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def rss_mb(pid):
+    """Memória residente do processo em MB (VmRSS de /proc/<pid>/status)"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class MemorySampler(threading.Thread):
+    """Amostra o RSS de cada worker durante a rodada e guarda o pico"""
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for pid in worker_pids(self.master_pid):
+                self.peak[pid] = max(self.peak.get(pid, 0.0), rss_mb(pid))
+            self.stopped.wait(self.interval)
+
+
+# ==================== TRÁFEGO ====================
+
+class VirtualUser:
+    """Cliente HTTP com conexão persistente e cookie de sessão próprios"""
+
+    def __init__(self, port, username, pending, lock):
+        self.port = port
+        self.username = username
+        self.pending = pending  # Parcelas pendentes do usuário (compartilhadas entre clientes do mesmo usuário)
+        self.lock = lock
+        self.cookies = {}
+        self.connection = None
+        self.account_id = None
+        self.category_id = None
+
+    def request(self, method, path, form=None):
+        """Envia a requisição (sem seguir redirects) e devolve (status, corpo)"""
+        headers = {'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items())}
+        body = None
+        if form is not None:
+            body = urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # Worker fechou a conexão ociosa: reconectar uma vez
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, rest = value.partition('=')
+                self.cookies[name] = rest.split(';', 1)[0]
+        return response.status, data
+
+    def login(self):
+        self.cookies.clear()
+        status, _ = self.request('POST', '/login', {'username': self.username, 'password': PASSWORD})
+        if status != 302:
+            return status
+
+        # IDs usados no formulário de novo lançamento
+        if self.account_id is None:
+            status, body = self.request('GET', '/transaction/add')
+            html = body.decode('utf-8', 'replace')
+            account = re.search(r'name="account_id"[^>]*>\s*<option value="">[^<]*</option>\s*<option value="(\d+)"', html)
+            category = re.search(r'<optgroup label="Despesas">\s*<option value="(\d+)"', html)
+            self.account_id = account.group(1) if account else None
+            self.category_id = category.group(1) if category else ''
+        return 302
+
+    def perform(self, action):
+        """Executa uma ação da mistura; devolve o status HTTP (None se não havia o que fazer)"""
+        if action == 'login':
+            return self.login()
+        if action == 'dashboard':
+            return self.request('GET', '/dashboard')[0]
+        if action == 'transactions':
+            return self.request('GET', '/transactions')[0]
+        if action == 'reports':
+            return self.request('GET', '/reports')[0]
+        if action == 'add_transaction':
+            return self.request('POST', '/transaction/add', {
+                'payment_method': 'debit',
+                'account_id': self.account_id,
+                'category_id': self.category_id,
+                'description': 'Teste de carga',
+                'amount': '%.2f' % random.uniform(5, 200),
+                'type': 'expense',
+                'date': date.today().isoformat(),
+            })[0]
+        if action == 'pay_installment':
+            with self.lock:
+                installment_id = self.pending.pop() if self.pending else None
+            if installment_id is None:
+                return None
+            return self.request('POST', f'/installment/pay/{installment_id}')[0]
+        raise ValueError(action)
+
+
+def run_traffic(port, concurrency, duration, pending, warmup):
+    """Dispara `concurrency` clientes pelo tempo pedido; devolve as amostras (ação, segundos, status)"""
+    samples, samples_lock = [], threading.Lock()
+    locks = {username: threading.Lock() for username in pending}
+    usernames = sorted(pending)
+    actions, weights = zip(*TRAFFIC_MIX)
+    stop_at = [0.0]
+    record_from = [0.0]
+
+    def start_clock():
+        # Executado uma vez, quando todos os clientes já fizeram login
+        record_from[0] = time.time() + warmup
+        stop_at[0] = record_from[0] + duration
+
+    start_barrier = threading.Barrier(concurrency, action=start_clock)
+
+    def client(index):
+        username = usernames[index % len(usernames)]
+        user = VirtualUser(port, username, pending[username], locks[username])
+        rng = random.Random(index)
+        local = []
+        try:
+            user.login()
+        except OSError:
+            pass
+        start_barrier.wait()
+
+        while time.time() < stop_at[0]:
+            action = rng.choices(actions, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = user.perform(action)
+            except (http.client.HTTPException, OSError):
+                status = 0
+            elapsed = time.perf_counter() - started
+            if status is not None and time.time() >= record_from[0]:
+                local.append((action, elapsed, status))
+
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+# ==================== RELATÓRIO ====================
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarize(samples, duration, lock_errors, memory, login_cpu):
+    latencies = [elapsed for _, elapsed, _ in samples]
+    logins = sum(1 for action, _, status in samples if action == 'login' and status == 302)
+    errors = sum(1 for _, _, status in samples if status == 0 or status >= 400)
+    per_action = {}
+    for action, elapsed, status in samples:
+        per_action.setdefault(action, []).append(elapsed)
+
+    return {
+        'requests': len(samples),
+        'throughput': len(samples) / duration if duration else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'lock_errors': lock_errors,
+        'lock_rate': lock_errors / len(samples) if samples else 0.0,
+        'login_throughput': logins / duration if duration else 0.0,
+        'login_cpu_ms': login_cpu,
+        'worker_rss_mb': sorted(round(value, 1) for value in memory.values()),
+        'actions': {
+            action: {'count': len(values), 'p50_ms': percentile(values, 0.50) * 1000, 'p99_ms': percentile(values, 0.99) * 1000}
+            for action, values in sorted(per_action.items())
+        },
+    }
+
+
+def print_table(results):
+    width = max([34] + [len(result['config']) for result in results])
+    header = (f'{"configuração":<{width}} {"conc":>5} {"req/s":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} '
+              f'{"erros":>7} {"locks":>7} {"login/s":>8} {"CPU/login":>10}  RSS/worker (MB)')
+    print()
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        rss = result['worker_rss_mb']
+        rss_text = f'{max(rss):.0f} máx, {sum(rss):.0f} total ({len(rss)})' if rss else '-'
+        print(f'{result["config"]:<{width}} {result["concurrency"]:>5} {result["throughput"]:>8.1f} '
+              f'{result["p50_ms"]:>8.1f} {result["p90_ms"]:>8.1f} {result["p99_ms"]:>8.1f} '
+              f'{result["error_rate"]:>6.1%} {result["lock_rate"]:>6.1%} '
+              f'{result["login_throughput"]:>8.1f} {result["login_cpu_ms"]:>7.1f} ms  {rss_text}')
+
+
+# ==================== EXECUÇÃO ====================
+
+def build_configs(args, default_hash_method):
+    configs = []
+    for worker_class in args.worker_class:
+        if worker_class == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print('gevent não instalado (pip install gevent): configurações gevent ignoradas.')
+                continue
+        for workers in args.workers:
+            for preload in ([False, True] if args.preload == 'both' else [args.preload == 'yes']):
+                for partition_mode in args.partition_mode:
+                    for hash_method in args.password_hash_method or [default_hash_method]:
+                        config = {
+                            'worker_class': worker_class,
+                            'workers': workers,
+                            'threads': args.threads,
+                            'connections': args.worker_connections,
+                            'preload': preload,
+                            'partition_mode': partition_mode,
+                            'password_hash_method': hash_method,
+                        }
+                        label = f'{worker_class} w={workers}'
+                        if worker_class == 'gthread':
+                            label += f' t={args.threads}'
+                        if preload:
+                            label += ' preload'
+                        if partition_mode != 'off':
+                            label += f' part={partition_mode}'
+                        if args.password_hash_method:
+                            label += f' {hash_method}'
+                        config['label'] = label
+                        configs.append(config)
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga da aplicação sob diferentes configurações do Gunicorn')
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gthread'], choices=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', nargs='+', type=int, default=[2, 4])
+    parser.add_argument('--threads', type=int, default=4, help='Threads por worker (gthread)')
+    parser.add_argument('--worker-connections', type=int, default=100, help='Conexões por worker (gevent)')
+    parser.add_argument('--preload', choices=['no', 'yes', 'both'], default='no')
+    parser.add_argument('--partition-mode', nargs='+', default=['off'], choices=['off', 'user', 'bucket'],
+                        help='Banco compartilhado (off) ou dividido por usuário/bucket')
+    parser.add_argument('--password-hash-method', nargs='+',
+                        help='Políticas de hash de senha comparadas (ex.: scrypt:32768:8:1 pbkdf2:sha256:600000); padrão: a da aplicação')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32], help='Clientes simultâneos')
+    parser.add_argument('--duration', type=float, default=20, help='Segundos medidos por rodada')
+    parser.add_argument('--warmup', type=float, default=3, help='Segundos iniciais descartados')
+    parser.add_argument('--users', type=int, default=20, help='Usuários semeados')
+    parser.add_argument('--transactions', type=int, default=2000, help='Transações por usuário')
+    parser.add_argument('--installments', type=int, default=50, help='Compras parceladas (6x) por usuário')
+    parser.add_argument('--json', help='Grava os resultados completos neste arquivo')
+    parser.add_argument('--keep', action='store_true', help='Mantém o diretório temporário (bancos e logs)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    seeded = os.path.join(workdir, 'seed.db')
+    print(f'Semeando {args.users} usuário(s) com {args.transactions} transações e {args.installments} parcelamentos cada...')
+    pending = seed_database(seeded, args.users, args.transactions, args.installments)
+    default_hash_method = sys.modules['app'].app.config['PASSWORD_HASH_METHOD']
+    login_cpu = {
+        method: login_cpu_ms(method)
+        for method in args.password_hash_method or [default_hash_method]
+    }
+
+    # Versão dividida do banco semeado para cada modo de particionamento pedido
+    seeds = {'off': (seeded, None)}
+    for partition_mode in args.partition_mode:
+        if partition_mode not in seeds:
+            print(f'Dividindo o banco semeado em partições ({partition_mode})...')
+            seeds[partition_mode] = split_seed(seeded, partition_mode, workdir)
+
+    results = []
+    try:
+        for config in build_configs(args, default_hash_method):
+            for concurrency in args.concurrency:
+                seed, seed_partitions = seeds[config['partition_mode']]
+                database = os.path.join(workdir, 'run.db')
+                partition_dir = os.path.join(workdir, 'run_partitions')
+                shutil.copy(seed, database)
+                shutil.rmtree(partition_dir, ignore_errors=True)
+                if seed_partitions:
+                    shutil.copytree(seed_partitions, partition_dir)
+                log_path = os.path.join(workdir, f'{config["label"].replace(" ", "_")}_c{concurrency}.log')
+
+                print(f'{config["label"]}, {concurrency} cliente(s)...', flush=True)
+                port = free_port()
+                process, log = start_server(config, database, partition_dir, port, log_path)
+                sampler = MemorySampler(process.pid)
+                sampler.start()
+                try:
+                    samples = run_traffic(
+                        port, concurrency, args.duration,
+                        {user: list(ids) for user, ids in pending.items()}, args.warmup
+                    )
+                finally:
+                    sampler.stopped.set()
+                    sampler.join()
+                    stop_server(process, log)
+
+                # Uma linha final de exceção por requisição que encontrou o banco travado
+                with open(log_path, errors='replace') as server_log:
+                    lock_errors = len(LOCK_ERROR.findall(server_log.read()))
+
+                result = summarize(samples, args.duration, lock_errors, sampler.peak, login_cpu[config['password_hash_method']])
+                result.update(config=config['label'], concurrency=concurrency, settings=config)
+                results.append(result)
+    finally:
+        if args.keep:
+            print(f'Bancos e logs mantidos em {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+        print(f'\nResultados gravados em {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+// Configuração usada por `python build_assets.py` (mesmo tema do fallback via CDN em base.html)
+module.exports = {
+  content: ['./templates/**/*.html'],
+  theme: {
+    extend: {
+      colors: {
+        primary: '#3B82F6',
+        success: '#10B981',
+        danger: '#EF4444',
+        warning: '#F59E0B',
+      }
+    }
+  }
+}
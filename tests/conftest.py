@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# Banco próprio dos testes, definido antes de importar a aplicação
+WORKDIR = tempfile.mkdtemp(prefix='wfinan-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORKDIR, "finance.db")}'
+os.environ['PARTITION_MODE'] = 'off'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as finance  # noqa: E402
+
+finance.app.config.update(TESTING=True, JOBS_INLINE=True, UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'))
+os.makedirs(finance.app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+with finance.app.app_context():
+    finance.init_db()
+
+
+@pytest.fixture
+def app():
+    with finance.app.app_context():
+        yield finance.app
+        finance.db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    """Usuário novo (com as categorias padrão) a cada teste"""
+    username = f'user-{uuid.uuid4().hex[:8]}'
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'email': f'{username}@example.com', 'password': 'secret'})
+    client.post('/login', data={'username': username, 'password': 'secret'})
+    return finance.User.query.filter_by(username=username).one(), client
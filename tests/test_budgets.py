@@ -0,0 +1,38 @@
+from app import Category, CreditCard, Installment, SpendCounter
+
+
+def counter_months(user_id):
+    return sorted(
+        (counter.year, counter.month, counter.total)
+        for counter in SpendCounter.query.filter_by(user_id=user_id) if counter.count
+    )
+
+
+def installment_months(user_id):
+    return sorted(
+        (installment.due_date.year, installment.due_date.month, installment.amount)
+        for installment in Installment.query.filter_by(user_id=user_id)
+    )
+
+
+def test_counters_follow_installments_when_card_days_change(user):
+    user, client = user
+    client.post('/credit-card/add', data={'name': 'Cartão', 'limit': '5000', 'closing_day': '5', 'due_day': '15'})
+    card = CreditCard.query.filter_by(user_id=user.id).one()
+    category = Category.query.filter_by(user_id=user.id, type='expense').first()
+
+    client.post('/transaction/add', data={
+        'payment_method': 'credit', 'credit_card_id': card.id, 'category_id': category.id,
+        'description': 'TV', 'amount': '300', 'type': 'expense', 'date': '2025-10-10',
+        'is_installment': 'on', 'installments_count': '3',
+    })
+    before = installment_months(user.id)
+    assert [(year, month) for year, month, _ in before] == [(2025, 11), (2025, 12), (2026, 1)]
+    assert counter_months(user.id) == before
+
+    client.post(f'/credit-card/edit/{card.id}', data={
+        'name': 'Cartão', 'limit': '5000', 'closing_day': '25', 'due_day': '5', 'active': 'on',
+    })
+    after = installment_months(user.id)
+    assert [(year, month) for year, month, _ in after] == [(2025, 12), (2026, 1), (2026, 2)]
+    assert counter_months(user.id) == after
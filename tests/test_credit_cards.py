@@ -0,0 +1,32 @@
+from datetime import date
+
+from app import CreditCard, InvoiceCycle, db
+
+
+def test_invoice_cycle_lookup_does_not_commit_the_caller(user):
+    user, client = user
+    card = CreditCard(user_id=user.id, name='Cartão', limit=1000, closing_day=10, due_day=20)
+    db.session.add(card)
+    db.session.commit()
+
+    card.name = 'Alterado'
+    cycle = card.get_invoice_cycle(date(2026, 3, 15))
+    assert cycle.start_date <= date(2026, 3, 15) < cycle.end_date
+
+    db.session.rollback()
+    assert db.session.get(CreditCard, card.id).name == 'Cartão'
+    assert InvoiceCycle.query.filter_by(credit_card_id=card.id).count() == 0
+
+
+def test_card_pages_persist_generated_cycles(user):
+    user, client = user
+    client.post('/credit-card/add', data={'name': 'Cartão', 'limit': '1000', 'closing_day': '10', 'due_day': '20'})
+    card = CreditCard.query.filter_by(user_id=user.id).one()
+    db.session.remove()
+
+    assert InvoiceCycle.query.filter_by(credit_card_id=card.id).count() > 0
+    assert client.get('/credit-cards').status_code == 200
+    assert client.get(f'/credit-card/invoice/{card.id}?cycle=2030-01').status_code == 200
+    db.session.remove()
+
+    assert InvoiceCycle.query.filter_by(credit_card_id=card.id, year=2030, month=1).count() == 1
@@ -0,0 +1,73 @@
+from datetime import date
+from decimal import Decimal
+
+from app import crc16_ccitt, modulo10, modulo11, parse_boleto, parse_nfce, parse_pix, parse_receipt_code
+
+# Exemplo do manual do PIX (Banco Central): chave aleatória, sem valor
+PIX = ('00020126580014br.gov.bcb.pix0136123e4567-e12b-12d1-a456-426655440000'
+       '5204000053039865802BR5913Fulano de Tal6008BRASILIA62070503***63041D3D')
+# O mesmo código com valor (campo 54 = 1.00)
+PIX_AMOUNT = ('00020126580014br.gov.bcb.pix0136123e4567-e12b-12d1-a456-426655440000'
+              '52040000530398654041.005802BR5913Fulano de Tal6008BRASILIA62070503***6304B836')
+
+# Itaú, vencimento 10/03/2026 (fator 1381 na base de 2022), R$ 1.234,56
+BOLETO_BARCODE = '34199138100001234561090012345670000000001234'
+BOLETO_LINE = '34191.09008 12345.670009 00000.012344 9 13810000123456'
+
+# Conta de energia com valor em reais e dígito módulo 10 (identificador 6), R$ 157,80
+CONVENIO_LINE = '83680000001-7 57800138202-2 60310123456-6 78901234567-2'
+
+NFCE_URL = ('https://www.nfce.fazenda.sp.gov.br/NFCeConsultaPublica/Paginas/ConsultaQRCode.aspx'
+            '?p=35260312345678000190650010000012341000012344|2|1|1|0F8A3C1D9B2E7A6C5D4E3F2A1B0C9D8E7F6A5B4C')
+# Emissão offline: chave|versão|ambiente|dia|valor|digest|id do CSC|hash
+NFCE_OFFLINE_URL = ('https://www.nfce.fazenda.sp.gov.br/qrcode'
+                    '?p=35260312345678000190650010000012349000012340|2|1|14|87.35|'
+                    '6B4A2F3E1D0C9B8A7F6E5D4C3B2A1F0E9D8C7B6A|1|A1B2C3D4E5F60718293A4B5C6D7E8F9012345678')
+
+
+def test_crc16_ccitt():
+    assert crc16_ccitt('123456789') == 0x29B1
+    assert f'{crc16_ccitt(PIX[:-4]):04X}' == '1D3D'
+
+
+def test_check_digits():
+    assert modulo10('341910900') == 8
+    assert modulo10('1234567000') == 9
+    assert 11 - modulo11(BOLETO_BARCODE[:4] + BOLETO_BARCODE[5:]) == 9
+
+
+def test_parse_pix():
+    assert parse_pix(PIX) == {'kind': 'pix', 'amount': None, 'date': None, 'description': 'Fulano de Tal'}
+    assert parse_pix(PIX_AMOUNT)['amount'] == Decimal('1.00')
+    assert parse_receipt_code(PIX_AMOUNT)['kind'] == 'pix'
+
+
+def test_parse_pix_rejects_bad_crc():
+    assert parse_pix(PIX[:-4] + '1D3E') is None
+    assert parse_pix(PIX_AMOUNT.replace('1.00', '9.00')) is None
+
+
+def test_parse_boleto():
+    expected = {'kind': 'boleto', 'amount': Decimal('1234.56'), 'date': date(2026, 3, 10), 'description': 'Boleto Itaú'}
+    assert parse_receipt_code(BOLETO_LINE) == expected
+    assert parse_boleto(BOLETO_BARCODE) == expected
+    # Dígito verificador geral errado
+    assert parse_boleto(BOLETO_BARCODE[:4] + '8' + BOLETO_BARCODE[5:]) is None
+
+
+def test_parse_convenio():
+    assert parse_receipt_code(CONVENIO_LINE) == {
+        'kind': 'convenio', 'amount': Decimal('157.80'), 'date': None, 'description': 'Energia elétrica e gás',
+    }
+    # Identificador 8: dígito módulo 11
+    assert parse_boleto('85850000000499000012026031012345678901234567')['amount'] == Decimal('49.90')
+    assert parse_boleto('83690000001578001382026031012345678901234567') is None
+
+
+def test_parse_nfce():
+    assert parse_receipt_code(NFCE_URL) == {
+        'kind': 'nfce', 'amount': None, 'date': None, 'description': 'NFC-e 12.345.678/0001-90',
+    }
+    offline = parse_nfce(NFCE_OFFLINE_URL)
+    assert (offline['date'], offline['amount']) == (date(2026, 3, 14), Decimal('87.35'))
+    assert parse_nfce('https://www.nfce.fazenda.sp.gov.br/qrcode?p=123|2|1') is None